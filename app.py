@@ -5,6 +5,8 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from db_engine import build_engine_options
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -27,10 +29,7 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///claude_dashboard.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = build_engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize the app with the extension
@@ -48,3 +47,10 @@ with app.app_context():
     import models
     import routes
     db.create_all()
+    
+    # Colonnes et index ajoutés après coup sur les bases existantes
+    from database import DatabaseManager
+    DatabaseManager.ensure_columns()
+    DatabaseManager.ensure_indexes()
+    DatabaseManager.ensure_search_index()
+    DatabaseManager.ensure_cost_rollup()
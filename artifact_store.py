@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stockage sur disque des exports de générations terminées, adressés par
+(génération, format, hash de la réponse : DatabaseManager.hash_response)
+"""
+
+import glob
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExportArtifactStore:
+    """Fichiers d'export construits une fois puis servis tels quels
+
+    Les chemins renvoyés sont relatifs à `root` (ce sont eux qui sont
+    enregistrés dans Generation.txt_file / md_file).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def relative_path(generation_id: str, format: str, response_hash: str) -> str:
+        return os.path.join(generation_id, f"{format}-{response_hash}.{format}")
+
+    def absolute_path(self, relative_path: str) -> str:
+        return os.path.join(self.root, relative_path)
+
+    def get(self, generation_id: str, format: str, response_hash: str) -> Optional[str]:
+        """Chemin relatif de l'export s'il existe déjà sur disque"""
+        relative_path = self.relative_path(generation_id, format, response_hash)
+        return relative_path if os.path.isfile(self.absolute_path(relative_path)) else None
+
+    def put(self, generation_id: str, format: str, response_hash: str, data: bytes) -> Optional[str]:
+        """Écrit l'export (écriture atomique) et retourne son chemin relatif, None en cas d'erreur"""
+        relative_path = self.relative_path(generation_id, format, response_hash)
+        path = self.absolute_path(relative_path)
+        if os.path.isfile(path):
+            return relative_path
+        try:
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{format}-")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+            # Exports d'une version précédente de la réponse
+            for stale in glob.glob(os.path.join(directory, f"{format}-*.{format}")):
+                if stale != path:
+                    os.unlink(stale)
+            return relative_path
+        except OSError as e:
+            logger.error(f"Erreur écriture export {format} de {generation_id}: {e}")
+            return None
+
+    def discard(self, generation_id: str) -> None:
+        """Supprime tous les exports d'une génération"""
+        shutil.rmtree(os.path.join(self.root, generation_id), ignore_errors=True)
@@ -6,12 +6,15 @@ Service de gestion des interactions avec Claude AI, OpenAI et xAI
 """
 
 import os
-import threading
-import time
+import asyncio
 import logging
 import uuid
 from datetime import datetime, timedelta
-import hashlib
+
+from generation_engine import AsyncGenerationEngine, GenerationScheduler
+from markdown_cache import RenderedMarkdownCache
+from response_cache import ResponseCache, make_cache_key
+from streaming import GenerationEventHub, LiveGenerationStore, SingleFlightGroup
 
 # Configuration de logging
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +23,9 @@ logger = logging.getLogger(__name__)
 # Le modèle par défaut
 DEFAULT_MODEL_STR = "claude-sonnet-4-20250514"
 
+# Taille des chunks lors de la relecture d'une réponse en cache
+CACHED_RESPONSE_CHUNK_SIZE = 512
+
 # Configuration des modèles disponibles
 AVAILABLE_MODELS = {
     # Modèles Claude 4.0 (nouveaux)
@@ -147,6 +153,75 @@ class ClaudeService:
     """Service pour gérer les interactions avec Claude AI, OpenAI et xAI"""
     
     def __init__(self):
+        self._init_clients()
+        
+        # État en mémoire des générations en cours, persisté aux transitions
+        # de statut et tous les `checkpoint_interval` secondes
+        self.checkpoint_interval = float(os.environ.get('GENERATION_CHECKPOINT_INTERVAL', '2.0'))
+        self.active_generations = LiveGenerationStore()
+        
+        # Diffusion des chunks et statuts vers les lecteurs SSE de ce processus
+        self.event_hub = GenerationEventHub()
+        
+        # Écriture différée (optionnelle) : un thread unique commite les
+        # écritures du service par transactions groupées
+        from database import DatabaseManager, DatabaseWriter, StreamChunkWriter
+        self.db_writer = None
+        if os.environ.get('DB_WRITE_BEHIND', '0').lower() in ('1', 'true', 'yes'):
+            self.db_writer = DatabaseWriter(
+                max_batch_size=int(os.environ.get('DB_WRITER_BATCH_SIZE', '64')),
+                max_delay=float(os.environ.get('DB_WRITER_MAX_DELAY', '0.02'))
+            )
+        
+        # Chunks de stream écrits par lots (taille ou délai, le premier atteint)
+        self.chunk_writer = StreamChunkWriter(
+            max_batch_size=int(os.environ.get('STREAM_CHUNK_BATCH_SIZE', '32')),
+            max_delay=float(os.environ.get('STREAM_CHUNK_FLUSH_INTERVAL', '0.25')),
+            db_writer=self.db_writer
+        )
+        self.db_manager = DatabaseManager()
+        
+        # Boucle asyncio unique exécutant toutes les générations
+        self.engine = AsyncGenerationEngine(
+            max_blocking_workers=int(os.environ.get('GENERATION_IO_WORKERS', '8'))
+        )
+        
+        # File d'attente bornée et nombre d'appels simultanés par provider
+        self.scheduler = GenerationScheduler(
+            limits={
+                'anthropic': int(os.environ.get('GENERATION_CONCURRENCY_ANTHROPIC', '4')),
+                'openai': int(os.environ.get('GENERATION_CONCURRENCY_OPENAI', '4')),
+                'openai-reasoning': int(os.environ.get('GENERATION_CONCURRENCY_OPENAI_REASONING', '2')),
+                'xai': int(os.environ.get('GENERATION_CONCURRENCY_XAI', '4')),
+            },
+            max_queue=int(os.environ.get('GENERATION_MAX_QUEUE', '50'))
+        )
+        
+        # Cache des réponses identiques (opt-in, activable par requête)
+        self.response_cache_enabled = os.environ.get('RESPONSE_CACHE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+        self.response_cache = ResponseCache(
+            self.db_manager,
+            max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', '256')),
+            max_age=float(os.environ.get('RESPONSE_CACHE_MAX_AGE', '86400'))
+        )
+        
+        # Requêtes identiques simultanées : un seul appel au provider, les
+        # suiveuses reçoivent les chunks de la meneuse (opt-in : l'échantillon
+        # est partagé, comme avec le cache de réponses)
+        self.coalescing_enabled = os.environ.get('GENERATION_COALESCING', '0').lower() in ('1', 'true', 'yes')
+        self.inflight = SingleFlightGroup()
+        self._follower_chunks = {}
+        
+        # Rendus Markdown → HTML des pages partagées et exports, calculés à la complétion
+        self.markdown_cache = RenderedMarkdownCache(
+            self.db_manager,
+            max_entries=int(os.environ.get('MARKDOWN_CACHE_SIZE', '128')),
+            persist=os.environ.get('MARKDOWN_CACHE_PERSIST', '0').lower() in ('1', 'true', 'yes'),
+            max_persisted=int(os.environ.get('MARKDOWN_CACHE_PERSIST_SIZE', '2000'))
+        )
+
+    def _init_clients(self):
+        """Initialiser les clients AI à partir des clés d'environnement"""
         self.anthropic_api_key = os.environ.get('ANTHROPIC_API_KEY')
         self.openai_api_key = os.environ.get('OPENAI_API_KEY')
         self.xai_api_key = os.environ.get('XAI_API_KEY')
@@ -161,7 +236,7 @@ class ClaudeService:
         if self.anthropic_api_key:
             try:
                 import anthropic
-                self.anthropic_client = anthropic.Anthropic(api_key=self.anthropic_api_key)
+                self.anthropic_client = anthropic.AsyncAnthropic(api_key=self.anthropic_api_key)
                 self.anthropic_available = True
                 logger.info("Client Anthropic initialisé avec succès")
             except ImportError:
@@ -174,8 +249,8 @@ class ClaudeService:
         # Initialiser OpenAI
         if self.openai_api_key:
             try:
-                from openai import OpenAI
-                self.openai_client = OpenAI(api_key=self.openai_api_key)
+                from openai import AsyncOpenAI
+                self.openai_client = AsyncOpenAI(api_key=self.openai_api_key)
                 self.openai_available = True
                 logger.info("Client OpenAI initialisé avec succès")
             except ImportError:
@@ -188,8 +263,8 @@ class ClaudeService:
         # Initialiser xAI
         if self.xai_api_key:
             try:
-                from openai import OpenAI
-                self.xai_client = OpenAI(
+                from openai import AsyncOpenAI
+                self.xai_client = AsyncOpenAI(
                     api_key=self.xai_api_key,
                     base_url="https://api.x.ai/v1"
                 )
@@ -201,13 +276,14 @@ class ClaudeService:
                 logger.error(f"Erreur initialisation client xAI: {e}")
         else:
             logger.warning("XAI_API_KEY non définie")
-        
-        self.active_generations = {}
-        from database import DatabaseManager
-        self.db_manager = DatabaseManager()
 
-    def generate_content(self, prompt: str, model: str = DEFAULT_MODEL_STR, stream: bool = True, conversation_history: list = None) -> dict:
-        """Générer du contenu avec le modèle spécifié"""
+    def generate_content(self, prompt: str, model: str = DEFAULT_MODEL_STR, stream: bool = True, conversation_history: list = None,
+                         params: dict = None, use_cache: bool = None) -> dict:
+        """Générer du contenu avec le modèle spécifié
+
+        `params` (paramètres d'échantillonnage) entre dans la clé du cache de
+        réponses ; `use_cache` force ou désactive ce cache pour la requête.
+        """
         generation_id = str(uuid.uuid4())
         
         # Debug de l'historique reçu
@@ -218,88 +294,146 @@ class ClaudeService:
         else:
             logger.info(f"[GENERATE_CONTENT] Aucun historique fourni")
         
-        # Créer une entrée de génération
-        generation_data = {
-            'id': generation_id,
-            'prompt': prompt,
-            'response': '',
-            'status': 'starting',
-            'timestamp': datetime.utcnow(),
-            'started_at': datetime.utcnow(),
-            'completed_at': None,
-            'token_count': 0,
-            'progress': 0.0,
-            'model_used': model
-        }
-        
-        # Sauvegarder immédiatement dans le contexte Flask
-        from app import app
-        with app.app_context():
-            success = self.db_manager.save_generation(generation_data)
-            if not success:
-                logger.error(f"Échec sauvegarde génération initiale {generation_id}")
-            else:
-                logger.info(f"Génération {generation_id} créée avec succès")
-                # Petit délai pour s'assurer que la transaction est commitée
-                import time
-                time.sleep(0.1)
+        # Réponse déjà générée pour une requête identique
+        prompt_hash = make_cache_key(model, prompt, conversation_history, params)
+        if use_cache is None:
+            use_cache = self.response_cache_enabled
+        cached = self.response_cache.get(prompt_hash) if use_cache else None
+        if cached is not None:
+            logger.info(f"Génération {generation_id} servie depuis le cache ({cached['generation_id']})")
+            self._create_generation(generation_id, prompt, model, prompt_hash=prompt_hash, cached_from=cached['generation_id'])
+            self.engine.submit(self._serve_cached_response(generation_id, prompt, model, cached))
+            return {'generation_id': generation_id, 'status': 'started', 'cached': True}
         
         model_config = AVAILABLE_MODELS.get(model, AVAILABLE_MODELS[DEFAULT_MODEL_STR])
         provider = model_config.get('provider', 'anthropic')
         
         # Vérifier si le provider est disponible
-        if provider == 'anthropic' and not self.anthropic_available:
-            logger.warning(f"Provider Anthropic non disponible pour {model}, simulation activée")
-            self._simulate_generation(generation_id, prompt, model)
-        elif provider == 'openai' and not self.openai_available:
-            logger.warning(f"Provider OpenAI non disponible pour {model}, simulation activée")
-            self._simulate_generation(generation_id, prompt, model)
-        elif provider == 'xai' and not self.xai_available:
-            logger.warning(f"Provider xAI non disponible pour {model}, simulation activée")
-            self._simulate_generation(generation_id, prompt, model)
+        simulated = (
+            (provider == 'anthropic' and not self.anthropic_available)
+            or (provider == 'openai' and not self.openai_available)
+            or (provider == 'xai' and not self.xai_available)
+        )
+        if simulated:
+            logger.warning(f"Provider {provider} non disponible pour {model}, simulation activée")
+            status = 'starting'
         else:
-            # Lancer la génération réelle dans un thread avec l'historique
-            thread = threading.Thread(
-                target=self._generate_async,
-                args=(generation_id, prompt, model, stream, conversation_history)
-            )
-            thread.daemon = True
-            thread.start()
+            # Une génération identique est déjà en cours : la suivre au lieu d'appeler le provider
+            coalesce = self.coalescing_enabled or use_cache
+            leader_id = self.inflight.lead_or_follow(prompt_hash, generation_id) if coalesce else None
+            if leader_id is not None:
+                logger.info(f"Génération {generation_id} rattachée à la génération en cours {leader_id}")
+                self._create_generation(generation_id, prompt, model, prompt_hash=prompt_hash, following=leader_id)
+                self.engine.submit(self._follow_generation(generation_id, leader_id, prompt, model, stream, conversation_history))
+                return {'generation_id': generation_id, 'status': 'started'}
+            
+            # Réserver une place avant toute écriture : lève QueueFullError si la file est pleine
+            try:
+                position = self.scheduler.reserve(generation_id, provider)
+            except Exception:
+                self.inflight.release(generation_id)
+                raise
+            logger.info(f"Génération {generation_id} en file {provider} (position {position})")
+            status = 'queued'
+        
+        # Les réponses simulées ne doivent pas alimenter le cache
+        self._create_generation(generation_id, prompt, model, status=status, prompt_hash=prompt_hash, cacheable=not simulated)
+        
+        if simulated:
+            coroutine = self._simulate_generation(generation_id, prompt, model)
+        else:
+            # Lancer la génération réelle sur la boucle du moteur avec l'historique
+            coroutine = self._generate_async(generation_id, prompt, model, stream, conversation_history)
+        try:
+            self.engine.submit(coroutine)
+        except Exception:
+            self.scheduler.cancel(generation_id, provider)
+            self.inflight.release(generation_id)
+            coroutine.close()
+            raise
         
         return {'generation_id': generation_id, 'status': 'started'}
     
-    def _generate_async(self, generation_id: str, prompt: str, model: str = DEFAULT_MODEL_STR, stream: bool = True, conversation_history: list = None):
-        """Génération asynchrone avec le provider approprié"""
-        from app import app
+    def _create_generation(self, generation_id: str, prompt: str, model: str, **fields):
+        """Créer une entrée de génération en mémoire et la sauvegarder immédiatement"""
+        self.active_generations.start(generation_id, prompt, model, **fields)
+        if not self._checkpoint_generation(generation_id):
+            logger.error(f"Échec sauvegarde génération initiale {generation_id}")
+        else:
+            self.db_manager.invalidate_stats()
+            logger.info(f"Génération {generation_id} créée avec succès")
+    
+    async def _follow_generation(self, generation_id: str, leader_id: str, prompt: str, model: str,
+                                 stream: bool, conversation_history: list):
+        """Suivre une génération identique en cours : rattrapage puis réception de ses mises à jour"""
+        # Instantané et rattachement sans await entre les deux : la meneuse ne
+        # peut pas avancer entre-temps sur la boucle du moteur
+        leader = self.active_generations.snapshot(leader_id)
+        if leader is None or not self.inflight.attach(leader_id, generation_id):
+            logger.info(f"Génération {leader_id} terminée avant le rattachement de {generation_id}, appel direct")
+            provider = AVAILABLE_MODELS.get(model, AVAILABLE_MODELS[DEFAULT_MODEL_STR]).get('provider', 'anthropic')
+            try:
+                self.scheduler.reserve(generation_id, provider)
+            except Exception as e:
+                await self._mark_generation_error(generation_id, str(e))
+                return
+            await self._generate_async(generation_id, prompt, model, stream, conversation_history)
+            return
         
+        self._follower_chunks[generation_id] = 0
+        # Rattrapage : la réponse déjà produite forme le premier chunk de la suiveuse
+        if leader['response']:
+            self._emit_follower_chunk(generation_id, leader['response'])
+        await self._update_live_generation(
+            generation_id,
+            append=leader['response'] or None,
+            status=leader['status'],
+            progress=leader['progress']
+        )
+    
+    def _emit_follower_chunk(self, generation_id: str, content: str):
+        """Émettre pour une suiveuse un chunk de sa meneuse, avec sa propre numérotation"""
+        chunk_index = self._follower_chunks.get(generation_id, 0)
+        self._follower_chunks[generation_id] = chunk_index + 1
+        self._emit_chunk(generation_id, chunk_index, content)
+    
+    async def _serve_cached_response(self, generation_id: str, prompt: str, model: str, cached: dict):
+        """Rejouer une réponse en cache comme un stream, sans appel au provider"""
         try:
-            # Marquer comme en cours
-            with app.app_context():
-                generation_data = {
-                    'id': generation_id,
-                    'prompt': prompt,
-                    'response': '',
-                    'status': 'generating',
-                    'timestamp': datetime.utcnow(),
-                    'started_at': datetime.utcnow(),
-                    'progress': 0.1,
-                    'model_used': model
-                }
-                self.db_manager.save_generation(generation_data)
+            await self._update_live_generation(generation_id, status='generating', progress=0.1)
+            response = cached['response']
+            step = CACHED_RESPONSE_CHUNK_SIZE
+            for chunk_index, start in enumerate(range(0, len(response), step)):
+                text = response[start:start + step]
+                self._emit_chunk(generation_id, chunk_index, text)
+                progress = min(0.9, 0.1 + 0.8 * (start + len(text)) / len(response))
+                await self._update_live_generation(generation_id, append=text, progress=progress)
             
-            if stream:
-                self._generate_streaming(generation_id, prompt, model, conversation_history)
-            else:
-                self._generate_simple(generation_id, prompt, model, conversation_history)
+            await self._complete_generation(generation_id, prompt, response, cached['token_count'], model, cached=True)
+        except Exception as e:
+            logger.error(f"Erreur relecture cache {generation_id}: {e}")
+            await self._mark_generation_error(generation_id, str(e))
+    
+    async def _generate_async(self, generation_id: str, prompt: str, model: str = DEFAULT_MODEL_STR, stream: bool = True, conversation_history: list = None):
+        """Génération asynchrone avec le provider approprié"""
+        provider = AVAILABLE_MODELS.get(model, AVAILABLE_MODELS[DEFAULT_MODEL_STR]).get('provider', 'anthropic')
+        try:
+            # Attendre une place libre pour ce provider
+            async with self.scheduler.slot(generation_id, provider):
+                # Marquer comme en cours
+                await self._update_live_generation(generation_id, status='generating', progress=0.1)
+                
+                if stream:
+                    await self._generate_streaming(generation_id, prompt, model, conversation_history)
+                else:
+                    await self._generate_simple(generation_id, prompt, model, conversation_history)
                 
         except Exception as e:
             logger.error(f"Erreur génération {generation_id}: {e}")
-            self._mark_generation_error(generation_id, str(e))
+            await self._mark_generation_error(generation_id, str(e))
 
-    def _generate_streaming(self, generation_id: str, prompt: str, model: str = DEFAULT_MODEL_STR, conversation_history: list = None):
+    async def _generate_streaming(self, generation_id: str, prompt: str, model: str = DEFAULT_MODEL_STR, conversation_history: list = None):
         """Génération avec streaming pour tous les providers"""
-        from app import app
-        
         try:
             response_text = ""
             chunk_index = 0
@@ -309,14 +443,14 @@ class ClaudeService:
             
             # Gestion spéciale pour les modèles O-Series
             if provider == 'openai-reasoning':
-                self._generate_openai_reasoning(generation_id, prompt, model)
+                await self._generate_openai_reasoning(generation_id, prompt, model)
                 return
             
             if provider == 'openai':
                 # Génération OpenAI
                 if not self.openai_client:
                     logger.error("Client OpenAI non initialisé")
-                    self._generate_simple(generation_id, prompt, model)
+                    await self._generate_simple(generation_id, prompt, model)
                     return
                     
                 # Construire les messages avec l'historique si présent
@@ -325,7 +459,7 @@ class ClaudeService:
                     messages.extend(conversation_history)
                 messages.append({"role": "user", "content": prompt})
                 
-                stream = self.openai_client.chat.completions.create(
+                stream = await self.openai_client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=1.0,
@@ -333,38 +467,27 @@ class ClaudeService:
                     stream=True
                 )
                 
-                for chunk in stream:
+                async for chunk in stream:
                     if chunk.choices[0].delta.content is not None:
                         content = chunk.choices[0].delta.content
                         response_text += content
                         
-                        with app.app_context():
-                            self.db_manager.save_stream_chunk(generation_id, chunk_index, content)
-                            progress = min(0.9, 0.1 + (len(response_text) / 1000) * 0.8)
-                            generation_data = {
-                                'id': generation_id,
-                                'prompt': prompt,
-                                'response': response_text.strip(),
-                                'status': 'generating',
-                                'timestamp': datetime.utcnow(),
-                                'started_at': datetime.utcnow(),
-                                'progress': progress,
-                                'model_used': model
-                            }
-                            self.db_manager.save_generation(generation_data)
+                        self._emit_chunk(generation_id, chunk_index, content)
+                        progress = min(0.9, 0.1 + (len(response_text) / 1000) * 0.8)
+                        await self._update_live_generation(generation_id, append=content, progress=progress)
                         chunk_index += 1
                 
                 # Finaliser
                 response_text = response_text.strip()
                 word_count = len(response_text.split())
                 token_count = max(1, int(word_count * 1.3))
-                self._complete_generation(generation_id, prompt, response_text, token_count, model)
+                await self._complete_generation(generation_id, prompt, response_text, token_count, model)
                 
             elif provider == 'xai':
                 # Génération xAI (même format que OpenAI) - pas de max_tokens spécifié
                 if not self.xai_client:
                     logger.error("Client xAI non initialisé")
-                    self._generate_simple(generation_id, prompt, model)
+                    await self._generate_simple(generation_id, prompt, model)
                     return
                     
                 # Construire les messages avec l'historique si présent
@@ -373,45 +496,34 @@ class ClaudeService:
                     messages.extend(conversation_history)
                 messages.append({"role": "user", "content": prompt})
                 
-                stream = self.xai_client.chat.completions.create(
+                stream = await self.xai_client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=1.0,
                     stream=True
                 )
                 
-                for chunk in stream:
+                async for chunk in stream:
                     if chunk.choices[0].delta.content is not None:
                         content = chunk.choices[0].delta.content
                         response_text += content
                         
-                        with app.app_context():
-                            self.db_manager.save_stream_chunk(generation_id, chunk_index, content)
-                            progress = min(0.9, 0.1 + (len(response_text) / 1000) * 0.8)
-                            generation_data = {
-                                'id': generation_id,
-                                'prompt': prompt,
-                                'response': response_text.strip(),
-                                'status': 'generating',
-                                'timestamp': datetime.utcnow(),
-                                'started_at': datetime.utcnow(),
-                                'progress': progress,
-                                'model_used': model
-                            }
-                            self.db_manager.save_generation(generation_data)
+                        self._emit_chunk(generation_id, chunk_index, content)
+                        progress = min(0.9, 0.1 + (len(response_text) / 1000) * 0.8)
+                        await self._update_live_generation(generation_id, append=content, progress=progress)
                         chunk_index += 1
                 
                 # Finaliser
                 response_text = response_text.strip()
                 word_count = len(response_text.split())
                 token_count = max(1, int(word_count * 1.3))
-                self._complete_generation(generation_id, prompt, response_text, token_count, model)
+                await self._complete_generation(generation_id, prompt, response_text, token_count, model)
                 
             else:
                 # Provider Anthropic
                 if not self.anthropic_client:
                     logger.error("Client Anthropic non initialisé")
-                    self._generate_simple(generation_id, prompt, model)
+                    await self._generate_simple(generation_id, prompt, model)
                     return
                     
                 if model_config.get('requires_beta', False):
@@ -423,14 +535,14 @@ class ClaudeService:
                     messages.append({"role": "user", "content": prompt})
                     
                     # Pour Claude 3.7 Sonnet, utiliser l'API bêta
-                    with self.anthropic_client.beta.messages.stream(
+                    async with self.anthropic_client.beta.messages.stream(
                         model=model,
                         max_tokens=model_config['max_tokens'],
                         temperature=1.0,
                         messages=messages,
                         betas=model_config.get('beta_features', [])
                     ) as stream:
-                        for chunk in stream:
+                        async for chunk in stream:
                             try:
                                 if hasattr(chunk, 'type') and chunk.type == "content_block_delta":
                                     if hasattr(chunk, 'delta') and hasattr(chunk.delta, 'text'):
@@ -438,22 +550,11 @@ class ClaudeService:
                                         if text:
                                             response_text += text
                                             
-                                            with app.app_context():
-                                                self.db_manager.save_stream_chunk(generation_id, chunk_index, text)
-                                                chunk_index += 1
-                                                
-                                                progress = min(0.9, 0.1 + (len(response_text) / 10000) * 0.8)
-                                                generation_data = {
-                                                    'id': generation_id,
-                                                    'prompt': prompt,
-                                                    'response': response_text,
-                                                    'status': 'generating',
-                                                    'timestamp': datetime.utcnow(),
-                                                    'started_at': datetime.utcnow(),
-                                                    'progress': progress,
-                                                    'model_used': model
-                                                }
-                                                self.db_manager.save_generation(generation_data)
+                                            self._emit_chunk(generation_id, chunk_index, text)
+                                            chunk_index += 1
+                                            
+                                            progress = min(0.9, 0.1 + (len(response_text) / 10000) * 0.8)
+                                            await self._update_live_generation(generation_id, append=text, progress=progress)
                             except Exception as chunk_error:
                                 logger.warning(f"Erreur processing chunk: {chunk_error}")
                                 continue
@@ -466,13 +567,13 @@ class ClaudeService:
                     messages.append({"role": "user", "content": prompt})
                     
                     # Pour les modèles normaux Claude (Sonnet 4.0 et Opus 4.0)
-                    with self.anthropic_client.messages.stream(
+                    async with self.anthropic_client.messages.stream(
                         model=model,
                         max_tokens=model_config['max_tokens'],
                         temperature=1.0,
                         messages=messages
                     ) as stream:
-                        for chunk in stream:
+                        async for chunk in stream:
                             try:
                                 if hasattr(chunk, 'type') and chunk.type == "content_block_delta":
                                     if hasattr(chunk, 'delta') and hasattr(chunk.delta, 'text'):
@@ -480,22 +581,11 @@ class ClaudeService:
                                         if text:
                                             response_text += text
                                             
-                                            with app.app_context():
-                                                self.db_manager.save_stream_chunk(generation_id, chunk_index, text)
-                                                chunk_index += 1
-                                                
-                                                progress = min(0.9, 0.1 + (len(response_text) / 10000) * 0.8)
-                                                generation_data = {
-                                                    'id': generation_id,
-                                                    'prompt': prompt,
-                                                    'response': response_text,
-                                                    'status': 'generating',
-                                                    'timestamp': datetime.utcnow(),
-                                                    'started_at': datetime.utcnow(),
-                                                    'progress': progress,
-                                                    'model_used': model
-                                                }
-                                                self.db_manager.save_generation(generation_data)
+                                            self._emit_chunk(generation_id, chunk_index, text)
+                                            chunk_index += 1
+                                            
+                                            progress = min(0.9, 0.1 + (len(response_text) / 10000) * 0.8)
+                                            await self._update_live_generation(generation_id, append=text, progress=progress)
                             except Exception as chunk_error:
                                 logger.warning(f"Erreur processing chunk: {chunk_error}")
                                 continue
@@ -504,13 +594,13 @@ class ClaudeService:
                 response_text = response_text.strip()
                 word_count = len(response_text.split())
                 token_count = max(1, int(word_count * 1.3))
-                self._complete_generation(generation_id, prompt, response_text, token_count, model)
+                await self._complete_generation(generation_id, prompt, response_text, token_count, model)
                 
         except Exception as e:
             logger.error(f"Erreur streaming: {e}")
-            self._generate_simple(generation_id, prompt, model)
+            await self._generate_simple(generation_id, prompt, model)
 
-    def _generate_simple(self, generation_id: str, prompt: str, model: str = DEFAULT_MODEL_STR, conversation_history: list = None):
+    async def _generate_simple(self, generation_id: str, prompt: str, model: str = DEFAULT_MODEL_STR, conversation_history: list = None):
         """Génération simple sans streaming"""
         try:
             model_config = AVAILABLE_MODELS.get(model, AVAILABLE_MODELS[DEFAULT_MODEL_STR])
@@ -519,7 +609,7 @@ class ClaudeService:
             if provider == 'openai':
                 if not self.openai_client:
                     logger.error("Client OpenAI non initialisé")
-                    self._mark_generation_error(generation_id, "Client OpenAI non disponible")
+                    await self._mark_generation_error(generation_id, "Client OpenAI non disponible")
                     return
                     
                 # Construire les messages avec l'historique si présent
@@ -529,7 +619,7 @@ class ClaudeService:
                     logger.info(f"[SIMPLE-OPENAI] Utilisation de l'historique de conversation avec {len(conversation_history)} messages")
                 messages.append({"role": "user", "content": prompt})
                 
-                response = self.openai_client.chat.completions.create(
+                response = await self.openai_client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=1.0,
@@ -540,7 +630,7 @@ class ClaudeService:
             elif provider == 'xai':
                 if not self.xai_client:
                     logger.error("Client xAI non initialisé")
-                    self._mark_generation_error(generation_id, "Client xAI non disponible")
+                    await self._mark_generation_error(generation_id, "Client xAI non disponible")
                     return
                     
                 # Construire les messages avec l'historique si présent
@@ -550,7 +640,7 @@ class ClaudeService:
                     logger.info(f"[SIMPLE-XAI] Utilisation de l'historique de conversation avec {len(conversation_history)} messages")
                 messages.append({"role": "user", "content": prompt})
                 
-                response = self.xai_client.chat.completions.create(
+                response = await self.xai_client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=1.0
@@ -561,7 +651,7 @@ class ClaudeService:
                 # Anthropic
                 if not self.anthropic_client:
                     logger.error("Client Anthropic non initialisé")
-                    self._mark_generation_error(generation_id, "Client Anthropic non disponible")
+                    await self._mark_generation_error(generation_id, "Client Anthropic non disponible")
                     return
                     
                 # Construire les messages avec l'historique si présent
@@ -572,7 +662,7 @@ class ClaudeService:
                 messages.append({"role": "user", "content": prompt})
                 
                 if model_config.get('requires_beta', False):
-                    response = self.anthropic_client.beta.messages.create(
+                    response = await self.anthropic_client.beta.messages.create(
                         model=model,
                         max_tokens=model_config['max_tokens'],
                         temperature=1.0,
@@ -580,7 +670,7 @@ class ClaudeService:
                         betas=model_config.get('beta_features', [])
                     )
                 else:
-                    response = self.anthropic_client.messages.create(
+                    response = await self.anthropic_client.messages.create(
                         model=model,
                         max_tokens=model_config['max_tokens'],
                         temperature=1.0,
@@ -590,46 +680,66 @@ class ClaudeService:
             
             word_count = len(response_text.split())
             token_count = max(1, int(word_count * 1.3))
-            self._complete_generation(generation_id, prompt, response_text, token_count, model)
+            await self._complete_generation(generation_id, prompt, response_text, token_count, model)
             
         except Exception as e:
             logger.error(f"Erreur génération simple: {e}")
-            self._mark_generation_error(generation_id, str(e))
+            await self._mark_generation_error(generation_id, str(e))
 
-    def _complete_generation(self, generation_id: str, prompt: str, response: str, token_count: int, model: str):
-        """Marquer une génération comme terminée"""
-        from app import app
-        
+    async def _complete_generation(self, generation_id: str, prompt: str, response: str, token_count: int, model: str,
+                                   cached: bool = False, cacheable: bool = True):
+        """Marquer une génération comme terminée
+
+        `cached` : réponse servie sans appel au provider, coût nul.
+        `cacheable=False` : réponse de secours ou message d'erreur, enregistrée
+        sans clé de cache pour ne jamais être resservie.
+        """
+        followers = self.inflight.release(generation_id)
+        self._follower_chunks.pop(generation_id, None)
         try:
-            with app.app_context():
-                generation_data = {
-                    'id': generation_id,
-                    'prompt': prompt,
-                    'response': response,
-                    'status': 'completed',
-                    'timestamp': datetime.utcnow(),
-                    'completed_at': datetime.utcnow(),
-                    'token_count': token_count,
-                    'progress': 1.0,
-                    'model_used': model
-                }
-                self.db_manager.save_generation(generation_data)
-                
-                # Enregistrer les coûts
-                self._track_cost(generation_id, prompt, response, model)
-                
-                if generation_id in self.active_generations:
-                    del self.active_generations[generation_id]
+            # Les chunks doivent être en base avant que le statut final soit visible
+            await self.engine.run_blocking(self.chunk_writer.flush, generation_id)
+            if generation_id not in self.active_generations:
+                self.active_generations.start(generation_id, prompt, model)
+            if not cacheable:
+                self.active_generations.update(generation_id, cacheable=False)
+            await self._update_live_generation(
+                generation_id,
+                response=response,
+                status='completed',
+                completed_at=datetime.utcnow(),
+                token_count=token_count,
+                progress=1.0
+            )
+            state = self.active_generations.snapshot(generation_id)
+            
+            # Enregistrer les coûts
+            await self.engine.run_blocking(self._track_cost, generation_id, prompt, response, model, cached)
+            await self.engine.run_blocking(self._compact_stream_chunks, generation_id)
+            
+            if state and state.get('cacheable') and state.get('prompt_hash'):
+                self.response_cache.put(state['prompt_hash'], generation_id, response, token_count)
+            
+            # Rendu HTML prêt avant le premier partage ou export
+            await self.engine.run_blocking(self.markdown_cache.warm, generation_id, response.strip())
+            
+            # Les suiveuses reçoivent la même réponse, sans coût
+            for follower_id in followers:
+                await self._complete_generation(follower_id, prompt, response, token_count, model, cached=True,
+                                                cacheable=bool(state and state.get('cacheable')))
                     
         except Exception as e:
             logger.error(f"Erreur completion: {e}")
+        finally:
+            self.active_generations.discard(generation_id)
 
-    def _track_cost(self, generation_id: str, prompt: str, response: str, model: str):
-        """Enregistrer les coûts d'une génération"""
+    def _track_cost(self, generation_id: str, prompt: str, response: str, model: str, cached: bool = False):
+        """Enregistrer les coûts d'une génération (nuls si la réponse vient du cache)"""
+        from app import app, db
+        
         try:
             from models_prompts import PRICING_DATA
             from models import CostTracking
-            from app import db
             
             # Obtenir les données de tarification
             pricing = PRICING_DATA.get(model)
@@ -641,9 +751,9 @@ class ClaudeService:
             prompt_words = len(prompt.split())
             response_words = len(response.split())
             
-            # Estimation : 1 token ≈ 0.75 mots
-            input_tokens = max(1, int(prompt_words / 0.75))
-            output_tokens = max(1, int(response_words / 0.75))
+            # Estimation : 1 token ≈ 0.75 mots ; aucun token consommé pour un hit du cache
+            input_tokens = 0 if cached else max(1, int(prompt_words / 0.75))
+            output_tokens = 0 if cached else max(1, int(response_words / 0.75))
             
             # Calculer les coûts
             input_cost = (input_tokens / 1000000) * pricing['input_cost']
@@ -661,9 +771,15 @@ class ClaudeService:
             cost_record.input_cost = input_cost
             cost_record.output_cost = output_cost
             cost_record.total_cost = total_cost
+            cost_record.created_at = datetime.utcnow()
             
-            db.session.add(cost_record)
-            db.session.commit()
+            # Ligne de coût et cumul journalier dans la même transaction
+            if self.db_writer is not None:
+                self.db_writer.submit(self._store_cost, cost_record)
+            else:
+                with app.app_context():
+                    self._store_cost(cost_record)
+                    db.session.commit()
             
             logger.info(f"Coût enregistré pour {generation_id}: ${total_cost:.4f}")
             
@@ -674,93 +790,192 @@ class ClaudeService:
             except:
                 pass
 
-    def _mark_generation_error(self, generation_id: str, error_message: str):
+    def _store_cost(self, cost_record):
+        """Ajoute une ligne de coût et son cumul journalier à la session courante, sans commit"""
+        from app import db
+        
+        db.session.add(cost_record)
+        self.db_manager.add_cost_to_rollup(cost_record)
+
+    async def _mark_generation_error(self, generation_id: str, error_message: str):
         """Marquer une génération comme échouée"""
         from app import app
         
+        def apply_error():
+            generation_data = self.db_manager.get_generation_by_id(generation_id)
+            if generation_data:
+                generation_data.update(error_fields)
+                self.db_manager.apply_generation(generation_data)
+        
+        def save_error_from_db():
+            if self.db_writer is not None:
+                # Transition de statut : attendre le commit
+                self.db_writer.submit(apply_error).result()
+            else:
+                with app.app_context():
+                    generation_data = self.db_manager.get_generation_by_id(generation_id)
+                    if generation_data:
+                        generation_data.update(error_fields)
+                        self.db_manager.save_generation(generation_data)
+            self.db_manager.invalidate_stats()
+        
+        followers = self.inflight.release(generation_id)
+        self._follower_chunks.pop(generation_id, None)
         try:
-            with app.app_context():
-                generation_data = {
-                    'id': generation_id,
-                    'status': 'error',
-                    'response': f"Erreur: {error_message}",
-                    'progress': 0.0,
-                    'completed_at': datetime.utcnow()
-                }
-                self.db_manager.save_generation(generation_data)
-                
-                if generation_id in self.active_generations:
-                    del self.active_generations[generation_id]
+            await self.engine.run_blocking(self.chunk_writer.flush, generation_id)
+            error_fields = {
+                'status': 'error',
+                'response': f"Erreur: {error_message}",
+                'error_message': error_message,
+                'progress': 0.0,
+                'completed_at': datetime.utcnow()
+            }
+            if generation_id in self.active_generations:
+                await self._update_live_generation(generation_id, **error_fields)
+            else:
+                await self.engine.run_blocking(save_error_from_db)
+                self.event_hub.publish_status(generation_id, 'error', 0.0)
+            await self.engine.run_blocking(self._compact_stream_chunks, generation_id)
+            
+            for follower_id in followers:
+                await self._mark_generation_error(follower_id, error_message)
                     
         except Exception as e:
             logger.error(f"Erreur marking error: {e}")
+        finally:
+            self.active_generations.discard(generation_id)
+
+    def _compact_stream_chunks(self, generation_id: str):
+        """Remplacer les chunks d'une génération finie par leurs bornes dans la réponse"""
+        if self.db_writer is not None:
+            self.db_writer.submit(self.db_manager.apply_stream_compaction, generation_id)
+        else:
+            self.db_manager.compact_stream_chunks(generation_id)
+
+    def _emit_chunk(self, generation_id: str, chunk_index: int, content: str):
+        """Enregistrer un chunk de stream et le diffuser aux lecteurs abonnés et aux suiveuses"""
+        self.chunk_writer.add(generation_id, chunk_index, content)
+        self.event_hub.publish_chunk(generation_id, chunk_index, content)
+        # Tous les chemins de streaming passent par ici, y compris les O-Series
+        # qui mettent à jour l'état par `response=` et non par `append=`
+        for follower_id in self.inflight.followers(generation_id):
+            self._emit_follower_chunk(follower_id, content)
+
+    async def _update_live_generation(self, generation_id: str, append: str = None, **fields) -> bool:
+        """Mettre à jour l'état en mémoire, persisté aux transitions et aux checkpoints"""
+        status_changed = self.active_generations.update(generation_id, append=append, **fields)
+        if status_changed is None:
+            return False
+        # Lues avant tout await : une suiveuse rattachée ensuite a déjà cette mise à jour
+        followers = self.inflight.followers(generation_id)
+        success = True
+        if status_changed or self.active_generations.checkpoint_due(generation_id, self.checkpoint_interval):
+            success = await self.engine.run_blocking(self._checkpoint_generation, generation_id, bool(status_changed))
+        if status_changed:
+            self.db_manager.invalidate_stats()
+        if 'status' in fields or 'progress' in fields:
+            state = self.active_generations.snapshot(generation_id)
+            if state:
+                self.event_hub.publish_status(generation_id, state['status'], state['progress'])
+        # Les chunks des suiveuses sont émis par _emit_chunk ; ici seul leur état suit
+        for follower_id in followers:
+            await self._update_live_generation(follower_id, append=append, **fields)
+        return success
+
+    def _checkpoint_generation(self, generation_id: str, wait: bool = True) -> bool:
+        """Persister l'état en mémoire d'une génération dans sa ligne Generation
+
+        En écriture différée, `wait` (transitions de statut) attend le commit ;
+        sinon le checkpoint est seulement mis en file.
+        """
+        from app import app
+        
+        generation_data = self.active_generations.snapshot(generation_id)
+        if generation_data is None:
+            return False
+        if self.db_writer is not None:
+            future = self.db_writer.submit(self.db_manager.apply_generation, generation_data)
+            self.active_generations.mark_checkpointed(generation_id)
+            if not wait:
+                return True
+            try:
+                future.result()
+                return True
+            except Exception as e:
+                logger.error(f"Échec checkpoint {generation_id}: {e}")
+                return False
+        with app.app_context():
+            success = self.db_manager.save_generation(generation_data)
+        if success:
+            self.active_generations.mark_checkpointed(generation_id)
+        return success
 
     def restart_clients(self):
         """Redémarrer les clients AI avec les nouvelles clés"""
         try:
-            self.__init__()
+            self._init_clients()
             logger.info("Clients AI redémarrés avec succès")
         except Exception as e:
             logger.error(f"Erreur redémarrage clients: {e}")
 
-    def _simulate_generation(self, generation_id: str, prompt: str, model: str):
+    async def _simulate_generation(self, generation_id: str, prompt: str, model: str):
         """Simulation de génération en cas d'API non disponible"""
         logger.info(f"Simulation de génération pour {model}")
         
-        def simulate():
-            time.sleep(2)
-            simulated_response = f"Réponse simulée pour le modèle {model}.\n\nPrompt reçu: {prompt[:100]}...\n\nCeci est une simulation car l'API réelle n'est pas disponible."
-            self._complete_generation(generation_id, prompt, simulated_response, 50, model)
-        
-        thread = threading.Thread(target=simulate)
-        thread.daemon = True
-        thread.start()
+        await asyncio.sleep(2)
+        simulated_response = f"Réponse simulée pour le modèle {model}.\n\nPrompt reçu: {prompt[:100]}...\n\nCeci est une simulation car l'API réelle n'est pas disponible."
+        await self._complete_generation(generation_id, prompt, simulated_response, 50, model)
 
     def get_generation_status(self, generation_id: str) -> dict:
-        """Obtenir le statut d'une génération"""
+        """Obtenir le statut d'une génération (en mémoire si elle est en cours)"""
+        status = self.active_generations.get_status(generation_id)
+        if status is not None:
+            queue_info = self.scheduler.queue_info(generation_id)
+            if queue_info:
+                status.update(queue_info)
+            return status
         return self.db_manager.get_generation(generation_id)
 
     def get_stream_chunks(self, generation_id: str, start_index: int = 0) -> list:
         """Obtenir les chunks de streaming d'une génération à partir d'un index"""
-        return self.db_manager.get_stream_chunks(generation_id, start_index)
+        # Lire d'abord les lots en attente : un chunk qui les quitte entre les
+        # deux lectures est déjà commité et sera renvoyé par la base
+        pending = self.chunk_writer.pending_chunks(generation_id, start_index)
+        chunks = self.db_manager.get_stream_chunks(generation_id, start_index)
+        if pending:
+            known = {chunk['chunk_index'] for chunk in chunks}
+            chunks.extend(chunk for chunk in pending if chunk['chunk_index'] not in known)
+            chunks.sort(key=lambda chunk: chunk['chunk_index'])
+        return chunks
 
     def get_available_models(self) -> dict:
         """Obtenir la liste des modèles disponibles"""
         return AVAILABLE_MODELS
 
-    def generate_text(self, prompt: str, model: str = DEFAULT_MODEL_STR, stream: bool = True, conversation_history: list = None) -> dict:
+    def generate_text(self, prompt: str, model: str = DEFAULT_MODEL_STR, stream: bool = True, conversation_history: list = None,
+                      params: dict = None, use_cache: bool = None) -> dict:
         """Alias pour generate_content avec support de l'historique de conversation"""
-        return self.generate_content(prompt, model, stream, conversation_history)
+        return self.generate_content(prompt, model, stream, conversation_history, params, use_cache)
 
-    def _generate_openai_reasoning(self, generation_id: str, prompt: str, model: str):
+    async def _generate_openai_reasoning(self, generation_id: str, prompt: str, model: str):
         """Génération spécifique pour les modèles OpenAI O-Series avec API responses.create"""
-        from app import app
-        import time
-        
         try:
             if not self.openai_client:
                 logger.error("Client OpenAI non initialisé pour modèle O-Series")
-                self._mark_generation_error(generation_id, "Client OpenAI non disponible")
+                await self._mark_generation_error(generation_id, "Client OpenAI non disponible")
                 return
             
             logger.info(f"Démarrage génération O-Series avec modèle {model}")
             
             # Marquer comme en cours avec un message spécial pour O-Series
-            with app.app_context():
-                generation_data = {
-                    'id': generation_id,
-                    'prompt': prompt,
-                    'response': '🧠 Modèle de raisonnement en cours de réflexion...',
-                    'status': 'reasoning',
-                    'timestamp': datetime.utcnow(),
-                    'started_at': datetime.utcnow(),
-                    'progress': 0.2,
-                    'model_used': model
-                }
-                self.db_manager.save_generation(generation_data)
-                
-                # Sauvegarder le chunk initial
-                self.db_manager.save_stream_chunk(generation_id, 0, '🧠 Réflexion en cours...')
+            await self._update_live_generation(
+                generation_id,
+                response='🧠 Modèle de raisonnement en cours de réflexion...',
+                status='reasoning',
+                progress=0.2
+            )
+            # Sauvegarder le chunk initial
+            self._emit_chunk(generation_id, 0, '🧠 Réflexion en cours...')
             
             # Utiliser l'API responses.create pour les modèles O-Series (sans fallback)
             try:
@@ -769,11 +984,11 @@ class ClaudeService:
                 # Vérifier si l'API responses existe
                 if not hasattr(self.openai_client, 'responses'):
                     logger.error(f"API responses.create non disponible pour {model}")
-                    self._mark_generation_error(generation_id, f"API responses.create requise pour le modèle {model} mais non disponible. Veuillez mettre à jour votre client OpenAI.")
+                    await self._mark_generation_error(generation_id, f"API responses.create requise pour le modèle {model} mais non disponible. Veuillez mettre à jour votre client OpenAI.")
                     return
                 
                 # Structure correcte pour l'API responses.create selon l'exemple
-                response_stream = self.openai_client.responses.create(
+                response_stream = await self.openai_client.responses.create(
                     model=model,
                     input=[{
                         "role": "user",
@@ -797,7 +1012,7 @@ class ClaudeService:
                 )
                 
                 # Parser le streaming SSE des modèles O-Series selon l'exemple
-                self._parse_o_series_stream(generation_id, prompt, response_stream, model)
+                await self._parse_o_series_stream(generation_id, prompt, response_stream, model)
                 
             except Exception as e:
                 logger.error(f"Erreur API responses.create pour {model}: {e}")
@@ -810,7 +1025,7 @@ class ClaudeService:
                 elif "authentication" in str(e).lower() or "unauthorized" in str(e).lower():
                     error_message = f"Authentification échouée pour {model}. Vérifiez votre clé API OpenAI."
                 
-                self._mark_generation_error(generation_id, error_message)
+                await self._mark_generation_error(generation_id, error_message)
                 
                 # Fallback vers l'API chat.completions standard avec simulation de raisonnement
                 logger.info(f"Fallback vers API chat.completions pour {model}")
@@ -829,7 +1044,7 @@ class ClaudeService:
 
 Prompt de l'utilisateur: {prompt}"""
 
-                    fallback_response = self.openai_client.chat.completions.create(
+                    fallback_response = await self.openai_client.chat.completions.create(
                         model="gpt-4o",  # Fallback vers un modèle standard
                         messages=[
                             {"role": "system", "content": f"Tu es un modèle de raisonnement avancé spécialisé. Tu dois toujours suivre la structure demandée avec les sections 'Processus de raisonnement' et 'Réponse finale'."},
@@ -841,7 +1056,8 @@ Prompt de l'utilisateur: {prompt}"""
                     
                     full_response = fallback_response.choices[0].message.content
                     logger.info(f"Fallback réussi pour {model}, réponse de {len(full_response)} caractères")
-                    self._simulate_o_series_streaming(generation_id, prompt, full_response, model)
+                    # Réponse d'un autre modèle : ne pas la mettre en cache pour celui demandé
+                    await self._simulate_o_series_streaming(generation_id, prompt, full_response, model, cacheable=False)
                     
                 except Exception as fallback_error:
                     logger.error(f"Erreur fallback pour {model}: {fallback_error}")
@@ -859,20 +1075,22 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
 3. Réessayer dans quelques minutes
 
 **Erreur:** {str(e)}"""
-                    self._simulate_o_series_streaming(generation_id, prompt, error_response, model)
+                    await self._simulate_o_series_streaming(generation_id, prompt, error_response, model, cacheable=False)
                 
         except Exception as e:
             logger.error(f"Erreur génération O-Series {generation_id}: {e}")
-            self._mark_generation_error(generation_id, f"Erreur modèle O-Series: {str(e)}")
+            await self._mark_generation_error(generation_id, f"Erreur modèle O-Series: {str(e)}")
 
-    def _simulate_o_series_streaming(self, generation_id: str, prompt: str, response_text: str, model: str):
+    async def _simulate_o_series_streaming(self, generation_id: str, prompt: str, response_text: str, model: str,
+                                           cacheable: bool = True):
         """Simuler le streaming pour les modèles O-Series qui peuvent avoir des délais"""
-        from app import app
-        import time
-        
         try:
+            # Reprendre le suivi en mémoire si la génération a été marquée en erreur
+            if generation_id not in self.active_generations:
+                self.active_generations.start(generation_id, prompt, model, status='reasoning', progress=0.2)
+            
             # Délai initial pour simuler la "réflexion"
-            time.sleep(2)
+            await asyncio.sleep(2)
             
             chunk_index = 1
             words = response_text.split()
@@ -882,39 +1100,26 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
             for i, word in enumerate(words):
                 current_text += word + " "
                 
-                with app.app_context():
-                    # Sauvegarder le chunk
-                    self.db_manager.save_stream_chunk(generation_id, chunk_index, word + " ")
-                    
-                    # Calculer le progrès
-                    progress = min(0.9, 0.3 + (i / len(words)) * 0.6)
-                    
-                    generation_data = {
-                        'id': generation_id,
-                        'prompt': prompt,
-                        'response': current_text.strip(),
-                        'status': 'generating',
-                        'timestamp': datetime.utcnow(),
-                        'started_at': datetime.utcnow(),
-                        'progress': progress,
-                        'model_used': model
-                    }
-                    self.db_manager.save_generation(generation_data)
+                # Sauvegarder le chunk
+                self._emit_chunk(generation_id, chunk_index, word + " ")
+                
+                # Calculer le progrès
+                progress = min(0.9, 0.3 + (i / len(words)) * 0.6)
+                await self._update_live_generation(generation_id, response=current_text, status='generating', progress=progress)
                 
                 chunk_index += 1
                 # Délai entre les mots pour simuler le streaming
-                time.sleep(0.05)
+                await asyncio.sleep(0.05)
             
             # Finaliser la génération
-            self._complete_generation(generation_id, prompt, response_text.strip(), len(words), model)
+            await self._complete_generation(generation_id, prompt, response_text.strip(), len(words), model, cacheable=cacheable)
             
         except Exception as e:
             logger.error(f"Erreur simulation streaming O-Series {generation_id}: {e}")
-            self._mark_generation_error(generation_id, str(e))
+            await self._mark_generation_error(generation_id, str(e))
 
-    def _parse_o_series_stream(self, generation_id: str, prompt: str, response_stream, model: str):
+    async def _parse_o_series_stream(self, generation_id: str, prompt: str, response_stream, model: str):
         """Parser le streaming SSE des modèles O-Series selon la structure officielle"""
-        from app import app
         import json
         
         try:
@@ -925,7 +1130,7 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
             logger.info(f"Début du parsing du stream O-Series pour {model}")
             
             # Parser les événements SSE
-            for chunk in response_stream:
+            async for chunk in response_stream:
                 try:
                     # Les chunks arrivent avec les événements SSE
                     if hasattr(chunk, 'type'):
@@ -937,21 +1142,15 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
                                 reasoning_text += chunk.delta
                                 
                                 # Sauvegarder le chunk de raisonnement
-                                with app.app_context():
-                                    self.db_manager.save_stream_chunk(generation_id, chunk_index, chunk.delta)
-                                    
-                                    # Mettre à jour le statut avec le raisonnement en cours
-                                    generation_data = {
-                                        'id': generation_id,
-                                        'prompt': prompt,
-                                        'response': f"## 🧠 Processus de raisonnement:\n\n{reasoning_text}",
-                                        'status': 'reasoning',
-                                        'timestamp': datetime.utcnow(),
-                                        'started_at': datetime.utcnow(),
-                                        'progress': min(0.5, 0.2 + (len(reasoning_text) / 500) * 0.3),
-                                        'model_used': model
-                                    }
-                                    self.db_manager.save_generation(generation_data)
+                                self._emit_chunk(generation_id, chunk_index, chunk.delta)
+                                
+                                # Mettre à jour le statut avec le raisonnement en cours
+                                await self._update_live_generation(
+                                    generation_id,
+                                    response=f"## 🧠 Processus de raisonnement:\n\n{reasoning_text}",
+                                    status='reasoning',
+                                    progress=min(0.5, 0.2 + (len(reasoning_text) / 500) * 0.3)
+                                )
                                 chunk_index += 1
                         
                         # Traitement de la réponse finale (output text)
@@ -960,23 +1159,16 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
                                 output_text += chunk.delta
                                 
                                 # Sauvegarder le chunk de réponse
-                                with app.app_context():
-                                    self.db_manager.save_stream_chunk(generation_id, chunk_index, chunk.delta)
-                                    
-                                    # Combiner raisonnement et réponse pour l'affichage avec espacement correct
-                                    full_response = f"## 🧠 Processus de raisonnement:\n\n{reasoning_text}\n\n---\n\n## 💬 Réponse finale:\n\n{output_text}"
-                                    
-                                    generation_data = {
-                                        'id': generation_id,
-                                        'prompt': prompt,
-                                        'response': full_response,
-                                        'status': 'generating',
-                                        'timestamp': datetime.utcnow(),
-                                        'started_at': datetime.utcnow(),
-                                        'progress': min(0.9, 0.5 + (len(output_text) / 200) * 0.4),
-                                        'model_used': model
-                                    }
-                                    self.db_manager.save_generation(generation_data)
+                                self._emit_chunk(generation_id, chunk_index, chunk.delta)
+                                
+                                # Combiner raisonnement et réponse pour l'affichage avec espacement correct
+                                full_response = f"## 🧠 Processus de raisonnement:\n\n{reasoning_text}\n\n---\n\n## 💬 Réponse finale:\n\n{output_text}"
+                                await self._update_live_generation(
+                                    generation_id,
+                                    response=full_response,
+                                    status='generating',
+                                    progress=min(0.9, 0.5 + (len(output_text) / 200) * 0.4)
+                                )
                                 chunk_index += 1
                         
                         # Fin de la réponse
@@ -994,7 +1186,9 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
                             # Compter les tokens approximativement
                             estimated_tokens = len(final_response.split())
                             
-                            self._complete_generation(generation_id, prompt, final_response, estimated_tokens, model)
+                            # Sans texte de sortie, la réponse n'est qu'un message de remplacement
+                            await self._complete_generation(generation_id, prompt, final_response, estimated_tokens, model,
+                                                            cacheable=bool(output_text))
                             return
                             
                 except Exception as chunk_error:
@@ -1008,12 +1202,12 @@ Le modèle de raisonnement n'est pas disponible actuellement. Veuillez:
             else:
                 final_response = "Réponse incomplète"
             estimated_tokens = len(final_response.split())
-            self._complete_generation(generation_id, prompt, final_response, estimated_tokens, model)
+            await self._complete_generation(generation_id, prompt, final_response, estimated_tokens, model, cacheable=False)
             
         except Exception as e:
             logger.error(f"Erreur parsing stream O-Series {generation_id}: {e}")
             # En cas d'erreur, marquer comme erreur (plus de fallback)
-            self._mark_generation_error(generation_id, f"Erreur parsing stream {model}: {str(e)}")
+            await self._mark_generation_error(generation_id, f"Erreur parsing stream {model}: {str(e)}")
 
     def _get_api_keys_status(self):
         """Obtenir le statut des clés API configurées"""
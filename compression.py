@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compression transparente des grands textes (prompt, réponse) stockés en base
+"""
+
+import base64
+import logging
+import os
+import zlib
+
+from sqlalchemy import func
+from sqlalchemy.types import Text, TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Préfixe des valeurs compressées, suivi d'une lettre de codec ('z' zlib, 's' zstd)
+COMPRESSED_MARKER = '\x01'
+
+# Mode de stockage : 'off' (défaut), 'zlib' ou 'zstd' ; les lectures décodent toujours
+TEXT_COMPRESSION = os.environ.get('TEXT_COMPRESSION', 'off').lower()
+TEXT_COMPRESSION_MIN_SIZE = int(os.environ.get('TEXT_COMPRESSION_MIN_SIZE', '1024'))
+ZLIB_LEVEL = int(os.environ.get('TEXT_COMPRESSION_LEVEL', '6'))
+
+if TEXT_COMPRESSION == 'zstd' and zstandard is None:
+    logger.warning("Module zstandard non installé, compression zlib utilisée")
+    TEXT_COMPRESSION = 'zlib'
+
+
+def compression_enabled() -> bool:
+    return TEXT_COMPRESSION in ('zlib', 'zstd')
+
+
+def compress_text(value):
+    """Forme stockée de `value` : compressée si le mode est actif et le texte assez long"""
+    if value is None:
+        return None
+    # Un texte clair qui commencerait par le marqueur doit toujours être encodé
+    forced = value.startswith(COMPRESSED_MARKER)
+    if not forced and (not compression_enabled() or len(value) < TEXT_COMPRESSION_MIN_SIZE):
+        return value
+
+    raw = value.encode('utf-8')
+    if TEXT_COMPRESSION == 'zstd':
+        codec, data = 's', zstandard.ZstdCompressor().compress(raw)
+    else:
+        codec, data = 'z', zlib.compress(raw, ZLIB_LEVEL)
+    # base85 : la colonne reste du texte (PostgreSQL TEXT n'accepte pas d'octets arbitraires)
+    encoded = COMPRESSED_MARKER + codec + base64.b85encode(data).decode('ascii')
+    if not forced and len(encoded) >= len(value):
+        return value
+    return encoded
+
+
+def decompress_text(value):
+    """Texte clair d'une valeur stockée, compressée ou non"""
+    if not value or not value.startswith(COMPRESSED_MARKER):
+        return value
+    codec, data = value[1], base64.b85decode(value[2:])
+    if codec == 's':
+        if zstandard is None:
+            raise RuntimeError("Module zstandard requis pour lire ce texte compressé")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    return zlib.decompress(data).decode('utf-8')
+
+
+def is_compressed(column):
+    """Expression SQL vraie pour les valeurs compressées de `column`"""
+    # func.substr n'a pas le type de la colonne : le marqueur est lié tel quel
+    return func.substr(column, 1, 1) == COMPRESSED_MARKER
+
+
+class CompressedText(TypeDecorator):
+    """Colonne TEXT dont les grandes valeurs sont stockées compressées
+
+    Les appelants lisent et écrivent toujours des `str`. Les expressions SQL
+    sur le contenu (substr, length, LIKE) ne voient que la forme stockée :
+    voir `is_compressed`.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
@@ -1,59 +1,45 @@
+import atexit
+import base64
 import logging
+import os
 import hashlib
+import json
+import queue
 import secrets
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Dict, Any, Optional
+from sqlalchemy import and_, case, func, inspect, or_, text, type_coerce, update
 from app import db
-from models import Generation, StreamBuffer
+from compression import CompressedText, compression_enabled, is_compressed, TEXT_COMPRESSION_MIN_SIZE
+import search_index
+from models import CostDailyRollup, CostTracking, Generation, RenderedMarkdown, StreamBuffer
 
 logger = logging.getLogger(__name__)
 
+# Durée de vie du cache des statistiques du dashboard
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', '5'))
+
+# Longueur des aperçus dans les vues liste (dashboard, historique)
+PROMPT_PREVIEW_CHARS = 100
+RESPONSE_PREVIEW_CHARS = 200
+
 class DatabaseManager:
     """Gestionnaire de base de données pour le dashboard Claude AI"""
     
+    # Cache des statistiques partagé par le processus : (expiration, valeurs)
+    _stats_cache: Optional[tuple] = None
+    _stats_version = 0
+    _stats_lock = threading.Lock()
+    _stats_version_lock = threading.Lock()
+    
     @staticmethod
     def save_generation(generation_data: Dict[str, Any]) -> bool:
         """Sauvegarde une génération"""
         try:
-            prompt_hash = hashlib.md5(generation_data['prompt'].encode()).hexdigest()
-            
-            # Chercher une génération existante
-            generation = Generation.query.filter_by(id=generation_data['id']).first()
-            
-            if generation:
-                # Mettre à jour l'existante
-                generation.prompt = generation_data['prompt']
-                generation.response = (generation_data.get('response', '')).strip()
-                generation.status = generation_data['status']
-                generation.timestamp = datetime.fromisoformat(generation_data['timestamp'].replace('Z', '+00:00')) if isinstance(generation_data['timestamp'], str) else generation_data['timestamp']
-                generation.started_at = datetime.fromisoformat(generation_data['started_at'].replace('Z', '+00:00')) if generation_data.get('started_at') and isinstance(generation_data['started_at'], str) else generation_data.get('started_at')
-                generation.completed_at = datetime.fromisoformat(generation_data['completed_at'].replace('Z', '+00:00')) if generation_data.get('completed_at') and isinstance(generation_data['completed_at'], str) else generation_data.get('completed_at')
-                generation.token_count = generation_data.get('token_count', 0)
-                generation.progress = generation_data.get('progress', 0.0)
-                generation.txt_file = generation_data.get('txt_file')
-                generation.md_file = generation_data.get('md_file')
-                generation.error_message = generation_data.get('error_message')
-                generation.prompt_hash = prompt_hash
-                generation.model_used = generation_data.get('model_used', 'claude-sonnet-4-20250514')
-            else:
-                # Créer une nouvelle génération
-                generation = Generation()
-                generation.id = generation_data['id']
-                generation.prompt = generation_data['prompt']
-                generation.response = (generation_data.get('response', '')).strip()
-                generation.status = generation_data['status']
-                generation.timestamp = datetime.fromisoformat(generation_data['timestamp'].replace('Z', '+00:00')) if isinstance(generation_data['timestamp'], str) else generation_data['timestamp']
-                generation.started_at = datetime.fromisoformat(generation_data['started_at'].replace('Z', '+00:00')) if generation_data.get('started_at') and isinstance(generation_data['started_at'], str) else generation_data.get('started_at')
-                generation.completed_at = datetime.fromisoformat(generation_data['completed_at'].replace('Z', '+00:00')) if generation_data.get('completed_at') and isinstance(generation_data['completed_at'], str) else generation_data.get('completed_at')
-                generation.token_count = generation_data.get('token_count', 0)
-                generation.progress = generation_data.get('progress', 0.0)
-                generation.txt_file = generation_data.get('txt_file')
-                generation.md_file = generation_data.get('md_file')
-                generation.error_message = generation_data.get('error_message')
-                generation.prompt_hash = prompt_hash
-                generation.model_used = generation_data.get('model_used', 'claude-sonnet-4-20250514')
-                db.session.add(generation)
-            
+            DatabaseManager.apply_generation(generation_data)
             db.session.commit()
             return True
         except Exception as e:
@@ -61,6 +47,72 @@ class DatabaseManager:
             db.session.rollback()
             return False
     
+    @staticmethod
+    def apply_generation(generation_data: Dict[str, Any]) -> Generation:
+        """Crée ou met à jour la ligne d'une génération dans la session courante, sans commit"""
+        if generation_data.get('cacheable') is False:
+            # Réponse simulée ou message d'erreur : sans clé, find_cached_response ne la renvoie jamais
+            prompt_hash = None
+        else:
+            prompt_hash = generation_data.get('prompt_hash') or hashlib.md5(generation_data['prompt'].encode()).hexdigest()
+        
+        # Chercher une génération existante
+        generation = Generation.query.filter_by(id=generation_data['id']).first()
+        previous_hash = generation.response_hash if generation else None
+        
+        if generation:
+            # Mettre à jour l'existante
+            generation.prompt = generation_data['prompt']
+            generation.response = (generation_data.get('response', '')).strip()
+            generation.status = generation_data['status']
+            generation.timestamp = datetime.fromisoformat(generation_data['timestamp'].replace('Z', '+00:00')) if isinstance(generation_data['timestamp'], str) else generation_data['timestamp']
+            generation.started_at = datetime.fromisoformat(generation_data['started_at'].replace('Z', '+00:00')) if generation_data.get('started_at') and isinstance(generation_data['started_at'], str) else generation_data.get('started_at')
+            generation.completed_at = datetime.fromisoformat(generation_data['completed_at'].replace('Z', '+00:00')) if generation_data.get('completed_at') and isinstance(generation_data['completed_at'], str) else generation_data.get('completed_at')
+            generation.token_count = generation_data.get('token_count', 0)
+            generation.progress = generation_data.get('progress', 0.0)
+            generation.txt_file = generation_data.get('txt_file') or generation.txt_file
+            generation.md_file = generation_data.get('md_file') or generation.md_file
+            generation.error_message = generation_data.get('error_message')
+            generation.prompt_hash = prompt_hash
+            generation.response_hash = DatabaseManager.hash_response(generation.response) if generation.status == 'completed' else None
+            generation.model_used = generation_data.get('model_used', 'claude-sonnet-4-20250514')
+        else:
+            # Créer une nouvelle génération
+            generation = Generation()
+            generation.id = generation_data['id']
+            generation.prompt = generation_data['prompt']
+            generation.response = (generation_data.get('response', '')).strip()
+            generation.status = generation_data['status']
+            generation.timestamp = datetime.fromisoformat(generation_data['timestamp'].replace('Z', '+00:00')) if isinstance(generation_data['timestamp'], str) else generation_data['timestamp']
+            generation.started_at = datetime.fromisoformat(generation_data['started_at'].replace('Z', '+00:00')) if generation_data.get('started_at') and isinstance(generation_data['started_at'], str) else generation_data.get('started_at')
+            generation.completed_at = datetime.fromisoformat(generation_data['completed_at'].replace('Z', '+00:00')) if generation_data.get('completed_at') and isinstance(generation_data['completed_at'], str) else generation_data.get('completed_at')
+            generation.token_count = generation_data.get('token_count', 0)
+            generation.progress = generation_data.get('progress', 0.0)
+            generation.txt_file = generation_data.get('txt_file')
+            generation.md_file = generation_data.get('md_file')
+            generation.error_message = generation_data.get('error_message')
+            generation.prompt_hash = prompt_hash
+            generation.response_hash = DatabaseManager.hash_response(generation.response) if generation.status == 'completed' else None
+            generation.model_used = generation_data.get('model_used', 'claude-sonnet-4-20250514')
+            db.session.add(generation)
+        
+        if generation.status == 'completed' and generation.response_hash != previous_hash:
+            DatabaseManager._index_generation(generation)
+        return generation
+    
+    @staticmethod
+    def _index_generation(generation: Generation) -> None:
+        """Indexe le texte clair d'une génération terminée dans la transaction courante
+        
+        L'indexation a son propre SAVEPOINT : un échec n'empêche pas
+        l'enregistrement de la génération.
+        """
+        try:
+            with db.session.begin_nested():
+                search_index.index_generation(db.session, generation.id, generation.prompt, generation.response)
+        except Exception as e:
+            logger.error(f"Erreur indexation recherche {generation.id}: {e}")
+    
     @staticmethod
     def save_stream_chunk(generation_id: str, chunk_index: int, content: str) -> bool:
         """Sauvegarde un chunk de stream"""
@@ -99,13 +151,53 @@ class DatabaseManager:
                     'md_file': generation.md_file,
                     'error_message': generation.error_message,
                     'model_used': generation.model_used,
-                    'share_token': generation.share_token
+                    'share_token': generation.share_token,
+                    'response_hash': DatabaseManager._ensure_response_hash(generation)
                 }
                 return None
         except Exception as e:
             logger.error(f"Erreur récupération génération: {e}")
             return None
     
+    @staticmethod
+    def hash_response(response: Optional[str]) -> str:
+        """Hash du texte d'une réponse terminée (ETag, artefacts d'export)"""
+        return hashlib.md5((response or "").strip().encode()).hexdigest()
+    
+    @staticmethod
+    def _ensure_response_hash(generation: Generation) -> Optional[str]:
+        """response_hash d'une génération terminée, calculé et enregistré s'il manque (lignes anciennes)"""
+        if generation.status != 'completed':
+            return None
+        if not generation.response_hash:
+            generation.response_hash = DatabaseManager.hash_response(generation.response)
+            try:
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"Erreur enregistrement response_hash: {e}")
+                db.session.rollback()
+        return generation.response_hash
+    
+    @staticmethod
+    def get_generation_version(generation_id: Optional[str] = None, share_token: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Champs qui identifient une version d'une génération, sans charger prompt ni réponse"""
+        from app import app
+        try:
+            with app.app_context():
+                query = db.session.query(
+                    Generation.id, Generation.status, Generation.response_hash,
+                    Generation.share_token, Generation.txt_file, Generation.md_file
+                )
+                if share_token is not None:
+                    query = query.filter(Generation.share_token == share_token)
+                else:
+                    query = query.filter(Generation.id == generation_id)
+                row = query.first()
+                return row._asdict() if row else None
+        except Exception as e:
+            logger.error(f"Erreur récupération version génération: {e}")
+            return None
+    
     @staticmethod
     def generate_share_token(generation_id: str) -> Optional[str]:
         """Génère un token de partage unique pour une génération"""
@@ -150,26 +242,58 @@ class DatabaseManager:
                     'md_file': generation.md_file,
                     'error_message': generation.error_message,
                     'model_used': generation.model_used,
-                    'share_token': generation.share_token
+                    'share_token': generation.share_token,
+                    'response_hash': DatabaseManager._ensure_response_hash(generation)
                 }
             return None
         except Exception as e:
             logger.error(f"Erreur récupération génération par token: {e}")
             return None
     
+    @staticmethod
+    def _truncate(preview: Optional[str], max_chars: int, full_length: Optional[int] = None, strip: bool = False) -> str:
+        """Termine un aperçu tronqué en SQL : coupe à `max_chars` et ajoute '...' si le texte est plus long"""
+        text = preview or ""
+        complete = full_length is None or full_length <= len(text)
+        if strip:
+            text = text.strip()
+        if len(text) > max_chars or not complete:
+            return text[:max_chars] + '...'
+        return text
+    
+    @staticmethod
+    def _preview_column(column, max_chars: int):
+        """Aperçu tronqué en SQL ; une valeur compressée est lue entière puis décompressée"""
+        return type_coerce(case((is_compressed(column), column), else_=func.substr(column, 1, max_chars)), CompressedText())
+    
+    @staticmethod
+    def _length_column(column):
+        """Longueur calculée en SQL, NULL pour une valeur compressée (mesurée après lecture)"""
+        return case((is_compressed(column), None), else_=func.length(column))
+    
     @staticmethod
     def get_active_generations() -> List[Dict[str, Any]]:
         """Récupère les générations en cours"""
         try:
-            generations = Generation.query.filter_by(status='generating').order_by(Generation.timestamp.desc()).all()
+            generations = db.session.query(
+                Generation.id,
+                DatabaseManager._preview_column(Generation.prompt, PROMPT_PREVIEW_CHARS + 1).label('prompt_preview'),
+                Generation.status,
+                Generation.progress,
+                Generation.timestamp,
+                Generation.started_at,
+                func.length(Generation.response).label('response_length'),
+                is_compressed(Generation.response).label('response_compressed')
+            ).filter(Generation.status == 'generating').order_by(Generation.timestamp.desc()).all()
             return [
                 {
                     'id': g.id,
-                    'prompt': g.prompt[:100] + '...' if len(g.prompt) > 100 else g.prompt,
+                    'prompt': DatabaseManager._truncate(g.prompt_preview, PROMPT_PREVIEW_CHARS),
                     'status': g.status,
                     'progress': g.progress,
                     'timestamp': g.timestamp.isoformat() if g.timestamp else None,
-                    'started_at': g.started_at.isoformat() if g.started_at else None
+                    'started_at': g.started_at.isoformat() if g.started_at else None,
+                    'response_length': DatabaseManager._active_response_length(g)
                 }
                 for g in generations
             ]
@@ -178,20 +302,75 @@ class DatabaseManager:
             return []
     
     @staticmethod
-    def get_history(limit: int = 50) -> List[Dict[str, Any]]:
-        """Récupère l'historique des générations"""
+    def _active_response_length(row) -> int:
+        """Longueur de la réponse d'une génération en cours (relue si elle est stockée compressée)"""
+        if not row.response_compressed:
+            return row.response_length or 0
+        response = db.session.query(Generation.response).filter(Generation.id == row.id).scalar()
+        return len(response or '')
+    
+    @staticmethod
+    def encode_history_cursor(item: Dict[str, Any]) -> str:
+        """Curseur opaque (timestamp, id) désignant la dernière entrée d'une page"""
+        return base64.urlsafe_b64encode(f"{item['timestamp']}|{item['id']}".encode()).decode()
+    
+    @staticmethod
+    def decode_history_cursor(cursor: str) -> Optional[tuple]:
+        """Décode un curseur d'historique, None s'il est invalide"""
+        try:
+            timestamp, generation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+            return datetime.fromisoformat(timestamp), generation_id
+        except (ValueError, UnicodeDecodeError):
+            return None
+    
+    @staticmethod
+    def get_history(limit: int = 50, cursor: Optional[str] = None, status: Optional[str] = None,
+                    model_used: Optional[str] = None, date_from: Optional[datetime] = None,
+                    date_to: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Récupère l'historique des générations, paginé par curseur (timestamp, id) décroissant"""
         from app import app
         try:
             with app.app_context():
-                generations = Generation.query.filter(
-                    Generation.status.in_(['completed', 'error'])
-                ).order_by(Generation.timestamp.desc()).limit(limit).all()
+                statuses = [status] if status in ('completed', 'error') else ['completed', 'error']
+                query = Generation.query.filter(Generation.status.in_(statuses))
+                if model_used:
+                    query = query.filter(Generation.model_used == model_used)
+                if date_from:
+                    query = query.filter(Generation.timestamp >= date_from)
+                if date_to:
+                    query = query.filter(Generation.timestamp < date_to)
+                if cursor:
+                    position = DatabaseManager.decode_history_cursor(cursor)
+                    if position is None:
+                        logger.warning(f"Curseur d'historique invalide: {cursor}")
+                        return []
+                    cursor_timestamp, cursor_id = position
+                    query = query.filter(or_(
+                        Generation.timestamp < cursor_timestamp,
+                        and_(Generation.timestamp == cursor_timestamp, Generation.id < cursor_id)
+                    ))
+                
+                # Seuls les aperçus tronqués en SQL sont transférés, pas les textes complets ;
+                # la marge de la réponse absorbe les blancs retirés par strip()
+                generations = query.order_by(Generation.timestamp.desc(), Generation.id.desc()).limit(limit).with_entities(
+                    Generation.id,
+                    DatabaseManager._preview_column(Generation.prompt, PROMPT_PREVIEW_CHARS + 1).label('prompt_preview'),
+                    DatabaseManager._preview_column(Generation.response, 2 * RESPONSE_PREVIEW_CHARS).label('response_preview'),
+                    DatabaseManager._length_column(Generation.response).label('response_length'),
+                    Generation.status,
+                    Generation.timestamp,
+                    Generation.completed_at,
+                    Generation.token_count,
+                    Generation.error_message,
+                    Generation.model_used
+                ).all()
                 
                 return [
                     {
                         'id': g.id,
-                        'prompt': g.prompt[:100] + '...' if len(g.prompt) > 100 else g.prompt,
-                        'response': ((g.response or "").strip()[:200] + '...') if len((g.response or "").strip()) > 200 else (g.response or "").strip(),
+                        'prompt': DatabaseManager._truncate(g.prompt_preview, PROMPT_PREVIEW_CHARS),
+                        'response': DatabaseManager._truncate(g.response_preview, RESPONSE_PREVIEW_CHARS, g.response_length, strip=True),
+                        'response_length': g.response_length if g.response_length is not None else len(g.response_preview or ''),
                         'status': g.status,
                         'timestamp': g.timestamp.isoformat() if g.timestamp else None,
                         'completed_at': g.completed_at.isoformat() if g.completed_at else None,
@@ -205,26 +384,354 @@ class DatabaseManager:
             logger.error(f"Erreur récupération historique: {e}")
             return []
     
+    @staticmethod
+    def find_cached_response(prompt_hash: str, max_age: float) -> Optional[Dict[str, Any]]:
+        """Dernière réponse complétée pour ce prompt_hash, si elle date de moins de `max_age` secondes"""
+        from app import app
+        try:
+            with app.app_context():
+                cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+                row = db.session.query(
+                    Generation.id,
+                    Generation.response,
+                    Generation.token_count,
+                    Generation.completed_at
+                ).filter(
+                    Generation.prompt_hash == prompt_hash,
+                    Generation.status == 'completed',
+                    Generation.completed_at >= cutoff,
+                    Generation.response != ''
+                ).order_by(Generation.completed_at.desc()).first()
+                
+                if row is None:
+                    return None
+                return {
+                    'generation_id': row.id,
+                    'response': row.response,
+                    'token_count': row.token_count or 0,
+                    'cached_at': row.completed_at.replace(tzinfo=timezone.utc).timestamp()
+                }
+        except Exception as e:
+            logger.error(f"Erreur recherche réponse en cache: {e}")
+            return None
+    
+    @staticmethod
+    def get_rendered_markdown(cache_key: str) -> Optional[str]:
+        """Rendu HTML persistant pour une clé de cache, None s'il n'existe pas"""
+        from app import app
+        try:
+            with app.app_context():
+                rendered = db.session.get(RenderedMarkdown, cache_key)
+                return rendered.html if rendered else None
+        except Exception as e:
+            logger.error(f"Erreur lecture rendu Markdown: {e}")
+            return None
+    
+    @staticmethod
+    def save_rendered_markdown(cache_key: str, generation_id: str, html: str, max_rows: int = 0) -> bool:
+        """Conserve un rendu HTML (une clé déjà présente est laissée telle quelle)
+
+        Avec `max_rows`, les rendus les plus anciens au-delà de cette limite
+        sont supprimés.
+        """
+        from app import app
+        try:
+            with app.app_context():
+                if db.session.get(RenderedMarkdown, cache_key) is None:
+                    db.session.add(RenderedMarkdown(cache_key=cache_key, generation_id=generation_id, html=html))
+                    db.session.flush()
+                    if max_rows > 0:
+                        expired = db.session.query(RenderedMarkdown.cache_key).order_by(
+                            RenderedMarkdown.created_at.desc(), RenderedMarkdown.cache_key
+                        ).offset(max_rows).scalar_subquery()
+                        RenderedMarkdown.query.filter(RenderedMarkdown.cache_key.in_(expired)).delete(synchronize_session=False)
+                    db.session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Erreur sauvegarde rendu Markdown: {e}")
+            db.session.rollback()
+            return False
+    
+    @staticmethod
+    def set_export_file(generation_id: str, format: str, path: str) -> bool:
+        """Enregistre le chemin de l'export TXT ou MD d'une génération"""
+        from app import app
+        column = {'txt': Generation.txt_file, 'md': Generation.md_file}.get(format)
+        if column is None:
+            return False
+        try:
+            with app.app_context():
+                Generation.query.filter(Generation.id == generation_id, or_(column.is_(None), column != path)).update(
+                    {column: path}, synchronize_session=False
+                )
+                db.session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Erreur enregistrement fichier d'export: {e}")
+            db.session.rollback()
+            return False
+    
     @staticmethod
     def get_stats() -> Dict[str, int]:
-        """Récupère les statistiques"""
+        """Récupère les statistiques (une requête GROUP BY, mise en cache STATS_CACHE_TTL secondes)"""
+        from app import app
+        cls = DatabaseManager
+        with cls._stats_lock:
+            if cls._stats_cache is not None and time.monotonic() < cls._stats_cache[0]:
+                return dict(cls._stats_cache[1])
+            version = cls._stats_version
+            try:
+                with app.app_context():
+                    counts = dict(db.session.query(Generation.status, func.count(Generation.id)).group_by(Generation.status).all())
+            except Exception as e:
+                logger.error(f"Erreur récupération statistiques: {e}")
+                return {'total': 0, 'completed': 0, 'error': 0, 'generating': 0}
+            
+            stats = {
+                'total': sum(counts.values()),
+                'completed': counts.get('completed', 0),
+                'error': counts.get('error', 0),
+                'generating': counts.get('generating', 0)
+            }
+            # Ne pas mettre en cache un résultat invalidé pendant la requête ; comparaison et
+            # écriture sous le verrou d'invalidate_stats pour qu'aucune invalidation ne s'intercale
+            with cls._stats_version_lock:
+                if version == cls._stats_version:
+                    cls._stats_cache = (time.monotonic() + STATS_CACHE_TTL, stats)
+            return dict(stats)
+    
+    @staticmethod
+    def invalidate_stats() -> None:
+        """Invalide le cache des statistiques après un changement de statut"""
+        with DatabaseManager._stats_version_lock:
+            DatabaseManager._stats_version += 1
+            DatabaseManager._stats_cache = None
+    
+    @staticmethod
+    def cost_period_start(start: datetime) -> datetime:
+        """Début de période de coûts arrondi à minuit, la granularité des cumuls journaliers"""
+        return datetime.combine(start.date(), datetime.min.time())
+    
+    @staticmethod
+    def get_cost_aggregates(start_date: datetime, month_start: datetime) -> Dict[str, Any]:
+        """Agrège les coûts depuis `start_date` à partir de la table de cumuls journaliers
+
+        Les cumuls sont par jour : `start_date` et `month_start` doivent être
+        à minuit (voir `cost_period_start`) pour couvrir la même fenêtre que
+        les requêtes sur cost_tracking.
+        """
         from app import app
+        empty = {'total_cost': 0.0, 'month_cost': 0.0, 'count': 0, 'by_model': [], 'by_provider': [], 'timeline': []}
         try:
             with app.app_context():
-                total = Generation.query.count()
-                completed = Generation.query.filter_by(status='completed').count()
-                error = Generation.query.filter_by(status='error').count()
-                generating = Generation.query.filter_by(status='generating').count()
+                period_filter = CostDailyRollup.day >= start_date.date()
+                
+                total_cost, month_cost, count = db.session.query(
+                    func.sum(CostDailyRollup.total_cost),
+                    func.sum(case((CostDailyRollup.day >= month_start.date(), CostDailyRollup.total_cost), else_=0.0)),
+                    func.sum(CostDailyRollup.count)
+                ).filter(period_filter).one()
+                
+                by_model = db.session.query(
+                    CostDailyRollup.model_id,
+                    func.max(CostDailyRollup.model_name),
+                    func.max(CostDailyRollup.provider),
+                    func.sum(CostDailyRollup.total_cost),
+                    func.sum(CostDailyRollup.input_tokens),
+                    func.sum(CostDailyRollup.output_tokens),
+                    func.sum(CostDailyRollup.count)
+                ).filter(period_filter).group_by(CostDailyRollup.model_id).order_by(func.sum(CostDailyRollup.total_cost).desc()).all()
+                
+                by_provider = db.session.query(
+                    CostDailyRollup.provider,
+                    func.sum(CostDailyRollup.total_cost)
+                ).filter(period_filter).group_by(CostDailyRollup.provider).all()
+                
+                timeline = db.session.query(
+                    CostDailyRollup.day,
+                    func.sum(CostDailyRollup.total_cost)
+                ).filter(period_filter).group_by(CostDailyRollup.day).order_by(CostDailyRollup.day).all()
                 
                 return {
-                    'total': total,
-                    'completed': completed,
-                    'error': error,
-                    'generating': generating
+                    'total_cost': total_cost or 0.0,
+                    'month_cost': month_cost or 0.0,
+                    'count': count or 0,
+                    'by_model': [
+                        {
+                            'model_id': model_id,
+                            'model_name': model_name,
+                            'provider': provider,
+                            'total_cost': cost or 0.0,
+                            'input_tokens': input_tokens or 0,
+                            'output_tokens': output_tokens or 0,
+                            'count': model_count or 0
+                        }
+                        for model_id, model_name, provider, cost, input_tokens, output_tokens, model_count in by_model
+                    ],
+                    'by_provider': [{'provider': provider, 'total_cost': cost or 0.0} for provider, cost in by_provider],
+                    'timeline': [(day.isoformat(), cost or 0.0) for day, cost in timeline]
                 }
         except Exception as e:
-            logger.error(f"Erreur récupération statistiques: {e}")
-            return {'total': 0, 'completed': 0, 'error': 0, 'generating': 0}
+            logger.error(f"Erreur agrégation coûts: {e}")
+            return empty
+    
+    @staticmethod
+    def get_most_expensive_generations(start_date: datetime, limit: int = 5) -> List[Dict[str, Any]]:
+        """Générations les plus coûteuses depuis `start_date` avec l'aperçu du prompt (une seule jointure)"""
+        from app import app
+        try:
+            with app.app_context():
+                rows = db.session.query(
+                    CostTracking.generation_id,
+                    CostTracking.model_name,
+                    CostTracking.provider,
+                    CostTracking.input_tokens,
+                    CostTracking.output_tokens,
+                    CostTracking.total_cost,
+                    CostTracking.created_at,
+                    DatabaseManager._preview_column(Generation.prompt, PROMPT_PREVIEW_CHARS).label('prompt_preview')
+                ).outerjoin(
+                    Generation, Generation.id == CostTracking.generation_id
+                ).filter(
+                    CostTracking.created_at >= start_date
+                ).order_by(CostTracking.total_cost.desc()).limit(limit).all()
+                
+                return [
+                    {
+                        'generation_id': row.generation_id,
+                        'model_name': row.model_name,
+                        'provider': row.provider,
+                        'input_tokens': row.input_tokens,
+                        'output_tokens': row.output_tokens,
+                        'total_cost': row.total_cost,
+                        'created_at': row.created_at.isoformat() if row.created_at else None,
+                        'prompt_preview': (row.prompt_preview or '')[:PROMPT_PREVIEW_CHARS]
+                    }
+                    for row in rows
+                ]
+        except Exception as e:
+            logger.error(f"Erreur récupération générations coûteuses: {e}")
+            return []
+    
+    @staticmethod
+    def add_cost_to_rollup(cost_record: CostTracking) -> None:
+        """Ajoute un coût au cumul journalier dans la transaction en cours (sans commit)"""
+        day = (cost_record.created_at or datetime.utcnow()).date()
+        values = {
+            'day': day,
+            'model_id': cost_record.model_id,
+            'provider': cost_record.provider,
+            'model_name': cost_record.model_name,
+            'input_tokens': cost_record.input_tokens or 0,
+            'output_tokens': cost_record.output_tokens or 0,
+            'input_cost': cost_record.input_cost or 0.0,
+            'output_cost': cost_record.output_cost or 0.0,
+            'total_cost': cost_record.total_cost or 0.0,
+            'count': 1
+        }
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(CostDailyRollup).values(**values)
+            excluded = statement.excluded
+            table = CostDailyRollup.__table__
+            statement = statement.on_conflict_do_update(
+                index_elements=['day', 'model_id', 'provider'],
+                set_={
+                    'model_name': excluded.model_name,
+                    'input_tokens': table.c.input_tokens + excluded.input_tokens,
+                    'output_tokens': table.c.output_tokens + excluded.output_tokens,
+                    'input_cost': table.c.input_cost + excluded.input_cost,
+                    'output_cost': table.c.output_cost + excluded.output_cost,
+                    'total_cost': table.c.total_cost + excluded.total_cost,
+                    'count': table.c.count + 1
+                }
+            )
+            db.session.execute(statement)
+            return
+        
+        rollup = db.session.get(CostDailyRollup, (day, cost_record.model_id, cost_record.provider))
+        if rollup is None:
+            db.session.add(CostDailyRollup(**values))
+            return
+        rollup.model_name = values['model_name']
+        for field in ('input_tokens', 'output_tokens', 'input_cost', 'output_cost', 'total_cost', 'count'):
+            setattr(rollup, field, getattr(rollup, field) + values[field])
+    
+    @staticmethod
+    def remove_cost_from_rollup(cost_record: CostTracking) -> None:
+        """Retire un coût du cumul journalier dans la transaction en cours (sans commit)"""
+        day = (cost_record.created_at or datetime.utcnow()).date()
+        key = and_(
+            CostDailyRollup.day == day,
+            CostDailyRollup.model_id == cost_record.model_id,
+            CostDailyRollup.provider == cost_record.provider
+        )
+        db.session.execute(update(CostDailyRollup).where(key).values(
+            input_tokens=CostDailyRollup.input_tokens - (cost_record.input_tokens or 0),
+            output_tokens=CostDailyRollup.output_tokens - (cost_record.output_tokens or 0),
+            input_cost=CostDailyRollup.input_cost - (cost_record.input_cost or 0.0),
+            output_cost=CostDailyRollup.output_cost - (cost_record.output_cost or 0.0),
+            total_cost=CostDailyRollup.total_cost - (cost_record.total_cost or 0.0),
+            count=CostDailyRollup.count - 1
+        ).execution_options(synchronize_session=False))
+        # Plus aucun coût ce jour-là : supprimer la ligne plutôt que garder des résidus flottants
+        db.session.query(CostDailyRollup).filter(key, CostDailyRollup.count <= 0).delete(synchronize_session=False)
+    
+    @staticmethod
+    def ensure_cost_rollup() -> int:
+        """Construit les cumuls journaliers d'une base antérieure à la table (vide alors que cost_tracking ne l'est pas)"""
+        from app import app
+        try:
+            with app.app_context():
+                if db.session.query(CostDailyRollup.day).first() is not None:
+                    return 0
+                if db.session.query(CostTracking.id).first() is None:
+                    return 0
+        except Exception as e:
+            logger.error(f"Erreur vérification cumuls de coûts: {e}")
+            return 0
+        logger.info("Cumuls de coûts absents, reconstruction depuis cost_tracking")
+        return DatabaseManager.rebuild_cost_rollup()
+    
+    @staticmethod
+    def rebuild_cost_rollup() -> int:
+        """Reconstruit entièrement les cumuls journaliers à partir de cost_tracking"""
+        from app import app
+        try:
+            with app.app_context():
+                day = func.date(CostTracking.created_at)
+                aggregated = db.session.query(
+                    day,
+                    CostTracking.model_id,
+                    CostTracking.provider,
+                    func.max(CostTracking.model_name),
+                    func.coalesce(func.sum(CostTracking.input_tokens), 0),
+                    func.coalesce(func.sum(CostTracking.output_tokens), 0),
+                    func.coalesce(func.sum(CostTracking.input_cost), 0.0),
+                    func.coalesce(func.sum(CostTracking.output_cost), 0.0),
+                    func.coalesce(func.sum(CostTracking.total_cost), 0.0),
+                    func.count(CostTracking.id)
+                ).filter(
+                    CostTracking.created_at.isnot(None)
+                ).group_by(day, CostTracking.model_id, CostTracking.provider)
+                
+                db.session.query(CostDailyRollup).delete()
+                result = db.session.execute(CostDailyRollup.__table__.insert().from_select(
+                    ['day', 'model_id', 'provider', 'model_name', 'input_tokens', 'output_tokens',
+                     'input_cost', 'output_cost', 'total_cost', 'count'],
+                    aggregated
+                ))
+                db.session.commit()
+                logger.info(f"Cumuls de coûts reconstruits: {result.rowcount} lignes")
+                return result.rowcount
+        except Exception as e:
+            logger.error(f"Erreur reconstruction cumuls de coûts: {e}")
+            db.session.rollback()
+            return 0
     
     @staticmethod
     def get_generation(generation_id: str) -> Optional[Dict[str, Any]]:
@@ -249,11 +756,145 @@ class DatabaseManager:
                         'timestamp': chunk.timestamp.isoformat() if chunk.timestamp else None
                     }
                     for chunk in chunks
-                ]
+                ] or DatabaseManager._replay_compacted_chunks(generation_id, start_index)
         except Exception as e:
             logger.error(f"Erreur récupération chunks: {e}")
             return []
     
+    @staticmethod
+    def _replay_compacted_chunks(generation_id: str, start_index: int) -> List[Dict[str, Any]]:
+        """Chunks d'une génération compactée, découpés dans `response` selon chunk_offsets"""
+        row = db.session.query(Generation.response, Generation.chunk_offsets, Generation.completed_at).filter(
+            Generation.id == generation_id
+        ).first()
+        if row is None or not row.chunk_offsets:
+            return []
+        layout = json.loads(row.chunk_offsets)
+        timestamp = row.completed_at.isoformat() if row.completed_at else None
+        chunks = []
+        start = 0
+        for position, end in enumerate(layout['ends']):
+            chunk_index = layout['first'] + position
+            if chunk_index >= start_index:
+                chunks.append({'chunk_index': chunk_index, 'content': row.response[start:end], 'timestamp': timestamp})
+            start = end
+        return chunks
+    
+    @staticmethod
+    def _chunk_offsets(chunks: List[Any], response: str) -> Optional[str]:
+        """Bornes des chunks dans `response` (JSON), None s'ils ne la recomposent pas"""
+        # Le premier chunk peut être un message d'attente absent de la réponse (modèles O-series)
+        for first in range(min(2, len(chunks))):
+            kept = chunks[first:]
+            if [chunk.chunk_index for chunk in kept] != list(range(kept[0].chunk_index, kept[0].chunk_index + len(kept))):
+                continue
+            raw = ''.join(chunk.content for chunk in kept)
+            if raw.strip() != response:
+                continue
+            # `response` est stockée sans les blancs de début et de fin
+            leading = len(raw) - len(raw.lstrip())
+            ends = []
+            end = 0
+            for chunk in kept:
+                end += len(chunk.content)
+                ends.append(min(max(0, end - leading), len(response)))
+            return json.dumps({'first': kept[0].chunk_index, 'ends': ends}, separators=(',', ':'))
+        return None
+    
+    @staticmethod
+    def apply_stream_compaction(generation_id: str) -> int:
+        """Remplace les chunks d'une génération terminée par leurs bornes dans la réponse, sans commit
+
+        Les chunks qui ne recomposent pas la réponse (génération en erreur)
+        sont simplement supprimés. Retourne le nombre de lignes supprimées.
+        """
+        generation = db.session.get(Generation, generation_id)
+        if generation is None or generation.status not in ('completed', 'error'):
+            return 0
+        chunks = db.session.query(StreamBuffer.chunk_index, StreamBuffer.content).filter(
+            StreamBuffer.generation_id == generation_id
+        ).order_by(StreamBuffer.chunk_index).all()
+        if not chunks:
+            return 0
+        generation.chunk_offsets = DatabaseManager._chunk_offsets(chunks, generation.response or '')
+        return StreamBuffer.query.filter(StreamBuffer.generation_id == generation_id).delete(synchronize_session=False)
+    
+    @staticmethod
+    def compact_stream_chunks(generation_id: str) -> int:
+        """Compacte les chunks d'une génération terminée"""
+        from app import app
+        try:
+            with app.app_context():
+                deleted = DatabaseManager.apply_stream_compaction(generation_id)
+                db.session.commit()
+                return deleted
+        except Exception as e:
+            logger.error(f"Erreur compactage chunks de {generation_id}: {e}")
+            db.session.rollback()
+            return 0
+    
+    @staticmethod
+    def compact_finished_stream_chunks() -> tuple:
+        """Compacte les chunks de toutes les générations terminées ; retourne (générations, lignes supprimées)"""
+        from app import app
+        with app.app_context():
+            generation_ids = [
+                row[0] for row in db.session.query(StreamBuffer.generation_id).join(
+                    Generation, Generation.id == StreamBuffer.generation_id
+                ).filter(Generation.status.in_(['completed', 'error'])).distinct().all()
+            ]
+        deleted = sum(DatabaseManager.compact_stream_chunks(generation_id) for generation_id in generation_ids)
+        return len(generation_ids), deleted
+    
+    @staticmethod
+    def compress_existing_texts(batch_size: int = 200) -> tuple:
+        """Compresse par lots les prompts et réponses stockés en clair ; retourne (lignes lues, lignes réécrites)
+        
+        Seules les générations terminées sont reprises (les générations en
+        cours sont compressées à leur prochain enregistrement). Parcours par
+        id croissant, un commit par lot.
+        """
+        from app import app
+        if not compression_enabled():
+            raise RuntimeError("TEXT_COMPRESSION doit valoir 'zlib' ou 'zstd' pour compresser les textes existants")
+        
+        def _uncompressed(column):
+            return and_(~is_compressed(column), func.length(column) >= TEXT_COMPRESSION_MIN_SIZE)
+        
+        scanned = rewritten = 0
+        last_id = ''
+        with app.app_context():
+            while True:
+                try:
+                    rows = db.session.query(
+                        Generation.id, Generation.prompt, Generation.response
+                    ).filter(
+                        Generation.id > last_id,
+                        Generation.status.in_(['completed', 'error']),
+                        or_(_uncompressed(Generation.prompt), _uncompressed(Generation.response))
+                    ).order_by(Generation.id).limit(batch_size).all()
+                    if not rows:
+                        break
+                    
+                    for row in rows:
+                        # Réécriture des valeurs lues : le type de colonne les compresse à l'écriture
+                        result = db.session.execute(
+                            update(Generation)
+                            .where(Generation.id == row.id, Generation.status.in_(['completed', 'error']))
+                            .values(prompt=row.prompt, response=row.response)
+                        )
+                        rewritten += result.rowcount
+                    db.session.commit()
+                except Exception as e:
+                    logger.error(f"Erreur compression des textes après {last_id or 'le début'}: {e}")
+                    db.session.rollback()
+                    break
+                
+                scanned += len(rows)
+                last_id = rows[-1].id
+                logger.info(f"Compression des textes: {scanned} générations traitées")
+        return scanned, rewritten
+    
     @staticmethod
     def update_generation_progress(generation_id: str, progress: float):
         """Met à jour le progrès d'une génération"""
@@ -272,11 +913,15 @@ class DatabaseManager:
         try:
             generation = Generation.query.filter_by(id=generation_id).first()
             if generation:
+                previous_hash = generation.response_hash
                 generation.response = response.strip()
+                generation.response_hash = DatabaseManager.hash_response(generation.response)
                 generation.status = 'completed'
                 generation.completed_at = datetime.utcnow()
                 generation.token_count = token_count
                 generation.progress = 1.0
+                if generation.response_hash != previous_hash:
+                    DatabaseManager._index_generation(generation)
                 db.session.commit()
         except Exception as e:
             logger.error(f"Erreur completion génération: {e}")
@@ -293,13 +938,18 @@ class DatabaseManager:
                 
                 # Supprimer les coûts associés
                 from models import CostTracking
+                for cost_record in CostTracking.query.filter_by(generation_id=generation_id).all():
+                    DatabaseManager.remove_cost_from_rollup(cost_record)
                 CostTracking.query.filter_by(generation_id=generation_id).delete()
+                RenderedMarkdown.query.filter_by(generation_id=generation_id).delete()
+                search_index.remove_generation(db.session, generation_id)
                 
                 # Supprimer la génération
                 generation = Generation.query.filter_by(id=generation_id).first()
                 if generation:
                     db.session.delete(generation)
                     db.session.commit()
+                    DatabaseManager.invalidate_stats()
                     logger.info(f"Génération {generation_id} supprimée")
                     return True
                 else:
@@ -309,6 +959,164 @@ class DatabaseManager:
             db.session.rollback()
             return False
 
+    @staticmethod
+    def ensure_columns() -> int:
+        """Ajoute les colonnes déclarées dans les modèles qui manquent sur une base existante
+
+        `db.create_all` ne modifie pas les tables déjà présentes : les
+        colonnes nullables ajoutées depuis sont créées par ALTER TABLE ADD
+        COLUMN, et une colonne unique reçoit un index unique.
+        """
+        from app import app
+        added = 0
+        with app.app_context():
+            engine = db.engine
+            existing_tables = set(inspect(engine).get_table_names())
+            for table in db.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    if not column.nullable and column.server_default is None:
+                        logger.error(f"Colonne {table.name}.{column.name} non nullable sans valeur par défaut: migration manuelle requise")
+                        continue
+                    try:
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        with engine.begin() as connection:
+                            connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+                            if column.unique:
+                                connection.exec_driver_sql(
+                                    f'CREATE UNIQUE INDEX IF NOT EXISTS uq_{table.name}_{column.name} ON {table.name} ({column.name})'
+                                )
+                        added += 1
+                        logger.info(f"Colonne {column.name} ajoutée à {table.name}")
+                    except Exception as e:
+                        logger.error(f"Erreur ajout colonne {table.name}.{column.name}: {e}")
+        return added
+
+    @staticmethod
+    def ensure_indexes() -> int:
+        """Crée les index déclarés dans les modèles qui manquent sur une base existante
+
+        `db.create_all` ne crée pas les index des tables déjà présentes. Sous
+        PostgreSQL ils sont construits avec CREATE INDEX CONCURRENTLY pour ne
+        pas bloquer les écritures ; sous SQLite seul l'index est construit,
+        la table n'est pas reconstruite.
+        """
+        from app import app
+        created = 0
+        with app.app_context():
+            engine = db.engine
+            existing_tables = set(inspect(engine).get_table_names())
+            for table in db.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name in existing:
+                        continue
+                    try:
+                        if engine.dialect.name == 'postgresql':
+                            columns = ', '.join(column.name for column in index.columns)
+                            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                                connection.exec_driver_sql(
+                                    f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {table.name} ({columns})'
+                                )
+                        else:
+                            index.create(bind=engine, checkfirst=True)
+                        created += 1
+                        logger.info(f"Index {index.name} créé sur {table.name}")
+                    except Exception as e:
+                        logger.error(f"Erreur création index {index.name}: {e}")
+        return created
+
+    @staticmethod
+    def ensure_search_index() -> Optional[str]:
+        """Crée l'index plein texte (FTS5 ou tsvector) s'il manque ; retourne le backend"""
+        from app import app
+        with app.app_context():
+            return search_index.ensure_search_index(db.engine)
+    
+    @staticmethod
+    def search_generations(query: str, limit: int = 20, offset: int = 0) -> Optional[List[Dict[str, Any]]]:
+        """Recherche plein texte classée par pertinence ; None si l'index est indisponible
+        
+        Les extraits (`snippet`) sont du HTML échappé, termes trouvés entre <mark>.
+        """
+        from app import app
+        try:
+            with app.app_context():
+                hits = search_index.search(db.session, query, limit, offset)
+                if not hits:
+                    return hits
+                
+                ids = [hit['generation_id'] for hit in hits]
+                rows = {row.id: row for row in db.session.query(
+                    Generation.id,
+                    DatabaseManager._preview_column(Generation.prompt, PROMPT_PREVIEW_CHARS + 1).label('prompt_preview'),
+                    Generation.status,
+                    Generation.timestamp,
+                    Generation.completed_at,
+                    Generation.token_count,
+                    Generation.model_used
+                ).filter(Generation.id.in_(ids)).all()}
+                
+                results = []
+                for hit in hits:
+                    row = rows.get(hit['generation_id'])
+                    if row is None:
+                        continue
+                    results.append({
+                        'id': row.id,
+                        'prompt': DatabaseManager._truncate(row.prompt_preview, PROMPT_PREVIEW_CHARS),
+                        'snippet': search_index.highlight(hit['snippet']),
+                        'score': hit['score'],
+                        'status': row.status,
+                        'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+                        'completed_at': row.completed_at.isoformat() if row.completed_at else None,
+                        'token_count': row.token_count,
+                        'model_used': row.model_used
+                    })
+                return results
+        except Exception as e:
+            logger.error(f"Erreur recherche plein texte: {e}")
+            db.session.rollback()
+            return None
+    
+    @staticmethod
+    def rebuild_search_index(batch_size: int = 500) -> int:
+        """Indexe par lots toutes les générations terminées ; retourne le nombre indexé"""
+        from app import app
+        indexed = 0
+        last_id = ''
+        with app.app_context():
+            if search_index.search_backend() is None:
+                raise RuntimeError("Index de recherche plein texte indisponible sur cette base")
+            while True:
+                try:
+                    rows = db.session.query(
+                        Generation.id, Generation.prompt, Generation.response
+                    ).filter(
+                        Generation.id > last_id,
+                        Generation.status == 'completed'
+                    ).order_by(Generation.id).limit(batch_size).all()
+                    if not rows:
+                        break
+                    for row in rows:
+                        search_index.index_generation(db.session, row.id, row.prompt, row.response)
+                    db.session.commit()
+                except Exception as e:
+                    logger.error(f"Erreur reconstruction de l'index de recherche après {last_id or 'le début'}: {e}")
+                    db.session.rollback()
+                    break
+                
+                indexed += len(rows)
+                last_id = rows[-1].id
+                logger.info(f"Index de recherche: {indexed} générations indexées")
+        return indexed
+    
     @staticmethod
     def cleanup_old_data(max_age_hours: int = 24):
         """Nettoie les anciennes données"""
@@ -324,6 +1132,12 @@ class DatabaseManager:
                 Generation.status.in_(['completed', 'error'])
             ).update({'is_persistent': False})
             
+            # Rendus Markdown anciens ou de générations disparues (recalculés à la demande)
+            RenderedMarkdown.query.filter(
+                (RenderedMarkdown.created_at < cutoff_time)
+                | ~RenderedMarkdown.generation_id.in_(db.session.query(Generation.id))
+            ).delete(synchronize_session=False)
+            
             db.session.commit()
             logger.info(f"Nettoyage des données de plus de {max_age_hours}h effectué")
         except Exception as e:
@@ -354,6 +1168,7 @@ class DatabaseManager:
                 db.session.commit()
                 
                 if count > 0:
+                    DatabaseManager.invalidate_stats()
                     logger.info(f"Nettoyé {count} générations bloquées")
                 
                 return count
@@ -362,3 +1177,211 @@ class DatabaseManager:
             logger.error(f"Erreur nettoyage générations bloquées: {e}")
             db.session.rollback()
             return 0
+
+
+
+class StreamChunkWriter:
+    """Regroupe les chunks de stream par génération et les insère par lots
+
+    Un lot est écrit en un seul INSERT multi-lignes dès que `max_batch_size`
+    chunks sont en attente ou que le plus ancien attend depuis `max_delay`
+    secondes. Les chunks non encore commités restent lisibles via
+    `pending_chunks` pour que les lecteurs ne voient jamais de trou.
+    Avec un `db_writer`, les lots passent par le thread d'écriture unique.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_delay: float = 0.25, db_writer: Optional['DatabaseWriter'] = None):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay
+        self.db_writer = db_writer
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_since: Dict[str, float] = {}
+        self._inflight: Dict[str, List[Dict[str, Any]]] = {}
+        self._thread = None
+
+    def add(self, generation_id: str, chunk_index: int, content: str):
+        """Ajoute un chunk au lot en attente de sa génération"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stream-chunk-writer', daemon=True)
+                self._thread.start()
+            batch = self._pending.setdefault(generation_id, [])
+            if not batch:
+                self._pending_since[generation_id] = time.monotonic()
+            batch.append({
+                'generation_id': generation_id,
+                'chunk_index': chunk_index,
+                'content': content,
+                'timestamp': datetime.utcnow()
+            })
+            if len(batch) >= self.max_batch_size:
+                self._wakeup.set()
+
+    def pending_chunks(self, generation_id: str, start_index: int = 0) -> List[Dict[str, Any]]:
+        """Chunks pas encore visibles en base, au format de get_stream_chunks"""
+        with self._lock:
+            rows = self._inflight.get(generation_id, []) + self._pending.get(generation_id, [])
+            return [
+                {
+                    'chunk_index': row['chunk_index'],
+                    'content': row['content'],
+                    'timestamp': row['timestamp'].isoformat()
+                }
+                for row in rows
+                if row['chunk_index'] >= start_index
+            ]
+
+    def flush(self, generation_id: Optional[str] = None):
+        """Écrit immédiatement les chunks en attente (d'une génération ou de toutes)"""
+        with self._lock:
+            generation_ids = [generation_id] if generation_id else list(self._pending)
+        for gid in generation_ids:
+            self._flush_generation(gid)
+
+    def _flush_generation(self, generation_id: str):
+        from app import app
+        
+        with self._flush_lock:
+            with self._lock:
+                rows = self._pending.pop(generation_id, None)
+                self._pending_since.pop(generation_id, None)
+                if not rows:
+                    return
+                self._inflight.setdefault(generation_id, []).extend(rows)
+            if self.db_writer is not None:
+                # File FIFO : les écritures soumises ensuite (statut final) passent après ce lot
+                future = self.db_writer.submit(self._insert_rows, rows)
+                future.add_done_callback(lambda f: self._batch_done(generation_id, rows, f))
+                return
+            try:
+                with app.app_context():
+                    self._insert_rows(rows)
+                    db.session.commit()
+            except Exception as e:
+                logger.error(f"Erreur écriture lot de chunks ({len(rows)}) pour {generation_id}: {e}")
+                db.session.rollback()
+            finally:
+                self._batch_done(generation_id, rows)
+
+    def _batch_done(self, generation_id: str, rows: List[Dict[str, Any]], future: Optional[Future] = None):
+        """Retire un lot écrit (ou abandonné) des chunks en cours d'écriture"""
+        if future is not None and future.exception() is not None:
+            logger.error(f"Erreur écriture lot de chunks ({len(rows)}) pour {generation_id}: {future.exception()}")
+        with self._lock:
+            inflight = self._inflight.get(generation_id, [])
+            del inflight[:len(rows)]
+            if not inflight:
+                self._inflight.pop(generation_id, None)
+
+    @staticmethod
+    def _insert_rows(rows: List[Dict[str, Any]]):
+        db.session.execute(StreamBuffer.__table__.insert().values(rows))
+
+    def _run(self):
+        """Boucle d'écriture : vide les lots pleins ou trop anciens"""
+        while True:
+            with self._lock:
+                oldest = min(self._pending_since.values(), default=None)
+            timeout = self.max_delay if oldest is None else max(0.0, oldest + self.max_delay - time.monotonic())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    gid for gid, batch in self._pending.items()
+                    if len(batch) >= self.max_batch_size
+                    or now - self._pending_since.get(gid, now) >= self.max_delay
+                ]
+            for gid in due:
+                self._flush_generation(gid)
+
+
+class DatabaseWriter:
+    """Thread unique qui applique les écritures mises en file par transactions groupées
+
+    Les opérations soumises sont des fonctions qui modifient `db.session`
+    sans commit. Le thread vide la file par lots (au plus `max_batch_size`
+    opérations ou `max_delay` secondes après la première) et commite chaque
+    lot en une transaction ; chaque opération s'exécute dans un SAVEPOINT,
+    de sorte qu'une opération en échec est annulée sans perdre les autres.
+    `submit` retourne un Future résolu après le commit du lot ; `barrier`
+    attend que tout ce qui a été soumis avant soit commité.
+    """
+
+    def __init__(self, max_batch_size: int = 64, max_delay: float = 0.02):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+
+    def submit(self, operation: Optional[Callable], *args) -> Future:
+        """Met une opération en file ; None sert de barrière"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.barrier, 5.0)
+        future = Future()
+        self._queue.put((operation, args, future))
+        return future
+
+    def barrier(self, timeout: Optional[float] = None) -> bool:
+        """Attend que les écritures soumises jusqu'ici soient commitées"""
+        if self._thread is None or threading.current_thread() is self._thread:
+            return True
+        try:
+            self.submit(None).result(timeout)
+            return True
+        except Exception as e:
+            logger.error(f"Barrière d'écriture non atteinte: {e}")
+            return False
+
+    def _run(self):
+        """Boucle d'écriture : regroupe les opérations en attente et les commite ensemble"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: List[tuple]):
+        from app import app
+
+        results = []
+        with app.app_context():
+            try:
+                if db.engine.dialect.name == 'sqlite':
+                    # Sans BEGIN explicite, pysqlite commiterait au RELEASE du premier SAVEPOINT
+                    db.session.execute(text('BEGIN IMMEDIATE'))
+                for operation, args, future in batch:
+                    if operation is None:
+                        results.append((future, None, None))
+                        continue
+                    try:
+                        with db.session.begin_nested():
+                            result = operation(*args)
+                        results.append((future, result, None))
+                    except Exception as e:
+                        logger.error(f"Erreur écriture différée {getattr(operation, '__name__', operation)}: {e}")
+                        results.append((future, None, e))
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"Erreur commit d'un lot de {len(batch)} écritures: {e}")
+                db.session.rollback()
+                for operation, args, future in batch:
+                    future.set_exception(e)
+                return
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Options du moteur SQLAlchemy selon le backend : PRAGMA SQLite (WAL, cache,
+mmap) et taille du pool de connexions PostgreSQL
+"""
+
+import logging
+import os
+import sqlite3
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+
+def _is_memory_sqlite(database_uri: str) -> bool:
+    return database_uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in database_uri
+
+
+def build_engine_options(database_uri: str) -> Dict[str, Any]:
+    """SQLALCHEMY_ENGINE_OPTIONS pour `database_uri`
+
+    Le pool (taille, débordement, attente, recyclage) se règle avec
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT et DB_POOL_RECYCLE.
+    """
+    if database_uri.startswith('sqlite'):
+        if _is_memory_sqlite(database_uri):
+            return {}
+        # Plusieurs threads de génération écrivent pendant que les lecteurs SSE interrogent la base
+        return {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 300)),
+        'pool_pre_ping': True,
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Réglages appliqués à chaque nouvelle connexion SQLite
+
+    WAL laisse les lecteurs lire pendant qu'un écrivain écrit ; busy_timeout
+    fait attendre un écrivain au lieu d'échouer avec "database is locked".
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        journal_mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        if journal_mode.lower() not in ('wal', 'memory'):
+            logger.warning(f"Mode WAL indisponible pour SQLite (journal_mode={journal_mode})")
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    finally:
+        cursor.close()
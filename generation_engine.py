@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Moteur asyncio des générations : une seule boucle d'événements, dans un
+thread dédié, exécute toutes les générations sous forme de coroutines
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGenerationEngine:
+    """Boucle asyncio partagée par toutes les générations
+
+    Les routes Flask soumettent des coroutines depuis n'importe quel thread
+    via `submit` ; les appels bloquants (base de données) sont délégués à
+    un pool de threads borné avec `run_blocking`.
+    """
+
+    def __init__(self, max_blocking_workers: int = 8):
+        self.max_blocking_workers = max_blocking_workers
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Boucle d'événements du moteur, démarrée au premier accès"""
+        with self._lock:
+            if self._loop is None:
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(ready,), name='generation-engine', daemon=True)
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    def _run(self, ready: threading.Event):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.max_blocking_workers,
+            thread_name_prefix='generation-engine-io'
+        ))
+        self._loop = loop
+        ready.set()
+        logger.info("Moteur de génération asyncio démarré")
+        loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Planifie une coroutine sur la boucle du moteur (thread-safe)"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    async def run_blocking(self, func: Callable, *args) -> Any:
+        """Exécute un appel bloquant hors de la boucle d'événements"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    @staticmethod
+    def _log_failure(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Erreur non gérée dans le moteur de génération: {future.exception()}")
+
+
+class QueueFullError(Exception):
+    """La file d'attente des générations est pleine"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"File d'attente pleine, réessayer dans {retry_after}s")
+        self.retry_after = retry_after
+
+
+class GenerationScheduler:
+    """File d'attente bornée et limites de concurrence par provider
+
+    `reserve` est appelé depuis le thread de la requête et refuse la
+    génération si la file est pleine ; la coroutine attend ensuite son tour
+    avec `slot`, dans l'ordre d'arrivée de son provider.
+    """
+
+    def __init__(self, limits: Dict[str, int], max_queue: int = 50, default_duration: float = 30.0):
+        self.limits = {provider: max(1, limit) for provider, limit in limits.items()}
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._waiting: Dict[str, List[str]] = {provider: [] for provider in self.limits}
+        self._running: Dict[str, int] = {provider: 0 for provider in self.limits}
+        self._enqueued_at: Dict[str, float] = {}
+        self._waits: Dict[str, float] = {}
+        self._avg_duration: Dict[str, float] = {provider: default_duration for provider in self.limits}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+
+    def _provider(self, provider: str) -> str:
+        return provider if provider in self.limits else 'anthropic'
+
+    def reserve(self, generation_id: str, provider: str) -> int:
+        """Réserve une place dans la file ; lève QueueFullError si elle est pleine"""
+        provider = self._provider(provider)
+        with self._lock:
+            if sum(len(waiting) for waiting in self._waiting.values()) >= self.max_queue:
+                raise QueueFullError(self._retry_after(provider))
+            self._waiting[provider].append(generation_id)
+            self._enqueued_at[generation_id] = time.monotonic()
+            return len(self._waiting[provider])
+
+    def cancel(self, generation_id: str, provider: str) -> None:
+        """Retire une réservation qui ne sera jamais exécutée"""
+        provider = self._provider(provider)
+        with self._lock:
+            if generation_id in self._waiting[provider]:
+                self._waiting[provider].remove(generation_id)
+            self._enqueued_at.pop(generation_id, None)
+
+    def queue_info(self, generation_id: str) -> Optional[Dict[str, Any]]:
+        """Position dans la file (0 si en cours) et temps d'attente en secondes"""
+        with self._lock:
+            if generation_id in self._waits:
+                return {'queue_position': 0, 'queue_wait': round(self._waits[generation_id], 3)}
+            for waiting in self._waiting.values():
+                if generation_id in waiting:
+                    return {
+                        'queue_position': waiting.index(generation_id) + 1,
+                        'queue_wait': round(time.monotonic() - self._enqueued_at[generation_id], 3)
+                    }
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Générations en attente et en cours par provider"""
+        with self._lock:
+            return {
+                provider: {
+                    'waiting': len(self._waiting[provider]),
+                    'running': self._running[provider],
+                    'limit': self.limits[provider]
+                }
+                for provider in self.limits
+            }
+
+    def _retry_after(self, provider: str) -> int:
+        """Estimation du délai avant qu'une place se libère (verrou tenu)"""
+        batches = (len(self._waiting[provider]) + 1) / self.limits[provider]
+        return max(1, min(300, math.ceil(batches * self._avg_duration[provider])))
+
+    def _condition(self, provider: str) -> asyncio.Condition:
+        if provider not in self._conditions:
+            self._conditions[provider] = asyncio.Condition()
+        return self._conditions[provider]
+
+    def _can_start(self, generation_id: str, provider: str) -> bool:
+        with self._lock:
+            waiting = self._waiting[provider]
+            return (
+                self._running[provider] < self.limits[provider]
+                and generation_id in waiting[:self.limits[provider] - self._running[provider]]
+            )
+
+    @asynccontextmanager
+    async def slot(self, generation_id: str, provider: str):
+        """Attend une place libre pour le provider puis la libère en sortie"""
+        provider = self._provider(provider)
+        condition = self._condition(provider)
+        try:
+            async with condition:
+                await condition.wait_for(lambda: self._can_start(generation_id, provider))
+                with self._lock:
+                    self._waiting[provider].remove(generation_id)
+                    self._running[provider] += 1
+                    self._waits[generation_id] = time.monotonic() - self._enqueued_at.pop(generation_id)
+        except BaseException:
+            self.cancel(generation_id, provider)
+            raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running[provider] -= 1
+                self._waits.pop(generation_id, None)
+                duration = time.monotonic() - started
+                self._avg_duration[provider] = 0.8 * self._avg_duration[provider] + 0.2 * duration
+            async with condition:
+                condition.notify_all()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache du rendu Markdown → HTML des réponses (pages partagées, exports HTML/PDF)
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import markdown
+
+# Extensions utilisées par la page partagée et par les exports HTML/PDF
+SHARE_EXTENSIONS = ('codehilite', 'fenced_code')
+EXPORT_EXTENSIONS = ('codehilite', 'fenced_code', 'tables')
+
+
+class RenderedMarkdownCache:
+    """LRU en mémoire du HTML rendu, indexé par (génération, hash de la réponse, extensions)
+
+    Le texte d'une génération terminée ne change plus : le rendu (coloration
+    Pygments comprise) n'est calculé qu'une fois. Avec `persist`, les rendus
+    sont aussi conservés dans la table rendered_markdown, limitée aux
+    `max_persisted` plus récents.
+    """
+
+    def __init__(self, db_manager, max_entries: int = 128, persist: bool = False, max_persisted: int = 2000):
+        self.db_manager = db_manager
+        self.max_entries = max_entries
+        self.persist = persist
+        self.max_persisted = max_persisted
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def cache_key(generation_id: str, text: str, extensions: Sequence[str]) -> str:
+        response_hash = hashlib.md5(text.encode()).hexdigest()
+        return f"{generation_id}:{response_hash}:{','.join(extensions)}"
+
+    def render(self, generation_id: str, text: str, extensions: Sequence[str] = EXPORT_EXTENSIONS) -> str:
+        """HTML de `text`, depuis le cache si possible"""
+        key = self.cache_key(generation_id, text, extensions)
+        html = self._get(key)
+        if html is not None:
+            return html
+
+        if self.persist:
+            html = self.db_manager.get_rendered_markdown(key)
+        if html is None:
+            html = markdown.markdown(text, extensions=list(extensions))
+            if self.persist:
+                self.db_manager.save_rendered_markdown(key, generation_id, html, max_rows=self.max_persisted)
+        self._put(key, html)
+        return html
+
+    def warm(self, generation_id: str, text: str) -> None:
+        """Pré-calcule les rendus de la page partagée et des exports"""
+        for extensions in (SHARE_EXTENSIONS, EXPORT_EXTENSIONS):
+            self.render(generation_id, text, extensions)
+
+    def discard(self, generation_id: str) -> None:
+        """Oublie les rendus d'une génération supprimée"""
+        prefix = f"{generation_id}:"
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def _put(self, key: str, html: str) -> None:
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -1,4 +1,5 @@
 from app import db
+from compression import CompressedText
 from datetime import datetime
 import uuid
 
@@ -6,8 +7,8 @@ class Generation(db.Model):
     __tablename__ = 'generations'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    prompt = db.Column(db.Text, nullable=False)
-    response = db.Column(db.Text, nullable=False, default='')
+    prompt = db.Column(CompressedText, nullable=False)
+    response = db.Column(CompressedText, nullable=False, default='')
     status = db.Column(db.String(20), nullable=False, default='pending')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -19,9 +20,17 @@ class Generation(db.Model):
     md_file = db.Column(db.String(255))
     error_message = db.Column(db.Text)
     prompt_hash = db.Column(db.String(32))
+    response_hash = db.Column(db.String(32))
+    chunk_offsets = db.Column(db.Text)
     model_used = db.Column(db.String(50), default='claude-sonnet-4-20250514')
     is_persistent = db.Column(db.Boolean, default=True)
     share_token = db.Column(db.String(32), unique=True, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_generations_status_timestamp', 'status', 'timestamp'),
+        db.Index('ix_generations_status_created_at', 'status', 'created_at'),
+        db.Index('ix_generations_prompt_hash', 'prompt_hash', 'status'),
+    )
 
 class StreamBuffer(db.Model):
     __tablename__ = 'stream_buffer'
@@ -33,6 +42,11 @@ class StreamBuffer(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     generation = db.relationship('Generation', backref='stream_chunks')
+    
+    __table_args__ = (
+        db.Index('ix_stream_buffer_generation_chunk', 'generation_id', 'chunk_index'),
+        db.Index('ix_stream_buffer_timestamp', 'timestamp'),
+    )
 
 
 class SavedPrompt(db.Model):
@@ -76,6 +90,12 @@ class CostTracking(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_cost_tracking_created_at', 'created_at'),
+        db.Index('ix_cost_tracking_generation_id', 'generation_id'),
+        db.Index('ix_cost_tracking_total_cost', 'total_cost'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -90,3 +110,29 @@ class CostTracking(db.Model):
             'total_cost': self.total_cost,
             'created_at': self.created_at.isoformat()
         }
+
+
+class CostDailyRollup(db.Model):
+    """Totaux de coûts par jour, modèle et fournisseur, tenus à jour à chaque génération"""
+    __tablename__ = 'cost_daily_rollup'
+    
+    day = db.Column(db.Date, primary_key=True)
+    model_id = db.Column(db.String(100), primary_key=True)
+    provider = db.Column(db.String(50), primary_key=True)
+    model_name = db.Column(db.String(100), nullable=False)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    input_cost = db.Column(db.Float, nullable=False, default=0.0)
+    output_cost = db.Column(db.Float, nullable=False, default=0.0)
+    total_cost = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RenderedMarkdown(db.Model):
+    """Rendu HTML persistant d'une réponse Markdown (cache des pages partagées et exports)"""
+    __tablename__ = 'rendered_markdown'
+    
+    cache_key = db.Column(db.String(200), primary_key=True)
+    generation_id = db.Column(db.String(36), nullable=False, index=True)
+    html = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
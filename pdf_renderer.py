@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rendu PDF des exports dans un pool de processus borné, avec délai et
+mémoire maximum par tâche
+"""
+
+import logging
+import multiprocessing
+import resource
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from generation_engine import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+class PdfRenderTimeout(Exception):
+    """Le rendu a dépassé le délai accordé à la tâche"""
+
+
+def _limit_worker_memory(memory_limit_mb: int) -> None:
+    """Initialisation d'un processus de rendu : plafond de mémoire allouée
+
+    RLIMIT_DATA (tas et mappings anonymes) plutôt que RLIMIT_AS, qui compte
+    aussi les bibliothèques et réservations virtuelles et ferait échouer
+    des rendus ordinaires.
+    """
+    if memory_limit_mb > 0:
+        limit = memory_limit_mb * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+        except (ValueError, OSError):
+            pass
+
+
+def _on_alarm(signum, frame):
+    raise PdfRenderTimeout()
+
+
+def render_pdf(html_template: str, simple_html: str, timeout: int) -> Tuple[Optional[bytes], str, list]:
+    """Exécuté dans un processus du pool : WeasyPrint puis xhtml2pdf
+
+    Retourne (pdf, moteur, erreurs) ; pdf vaut None si aucun moteur n'a
+    abouti. Rien n'est journalisé ici : les erreurs sont renvoyées au
+    processus parent.
+    """
+    errors = []
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(timeout)
+    # Filet de sécurité si le code natif ne rend pas la main au gestionnaire
+    # d'alarme : SIGXCPU termine le processus et le pool est recréé
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_limit = int(usage.ru_utime + usage.ru_stime) + 2 * timeout
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_hard == resource.RLIM_INFINITY or cpu_limit <= cpu_hard:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_hard))
+    try:
+        try:
+            import weasyprint
+            return weasyprint.HTML(string=html_template).write_pdf(), 'weasyprint', errors
+        except PdfRenderTimeout:
+            raise
+        except Exception as weasy_error:
+            errors.append(f"WeasyPrint: {weasy_error!r}")
+
+        try:
+            from xhtml2pdf import pisa
+            pdf_buffer = BytesIO()
+            pisa_status = pisa.CreatePDF(simple_html, dest=pdf_buffer)
+            if hasattr(pisa_status, 'err') and pisa_status.err:
+                raise Exception("Erreur xhtml2pdf")
+            return pdf_buffer.getvalue(), 'xhtml2pdf', errors
+        except PdfRenderTimeout:
+            raise
+        except Exception as xhtml_error:
+            errors.append(f"xhtml2pdf: {xhtml_error!r}")
+        return None, '', errors
+    finally:
+        signal.alarm(0)
+
+
+class PdfRenderPool:
+    """Pool de processus borné pour les exports PDF
+
+    Chaque rendu devient une tâche identifiée par un job_id : la requête
+    attend son résultat jusqu'à une échéance puis, si besoin, le client
+    interroge la tâche. Un résultat est oublié dès qu'il a été lu ; ceux
+    que personne ne vient chercher le sont après `job_ttl` secondes.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, timeout: int = 60,
+                 memory_limit_mb: int = 1024, job_ttl: float = 600.0):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = max(1, timeout)
+        self.memory_limit_mb = memory_limit_mb
+        self.job_ttl = job_ttl
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Pool de processus, créé au premier rendu (verrou tenu)"""
+        if self._executor is None:
+            # Pas de fork direct : le processus web a déjà des threads (moteur,
+            # écrivains) dont les verrous copiés pourraient bloquer le rendu.
+            # Le serveur forkserver ne précharge que ce module.
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_limit_worker_memory,
+                initargs=(self.memory_limit_mb,)
+            )
+            logger.info(f"Pool de rendu PDF démarré ({self.max_workers} processus)")
+        return self._executor
+
+    def _reset_executor(self) -> None:
+        """Remplace un pool cassé par l'arrêt d'un processus (verrou tenu)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.warning("Pool de rendu PDF recréé après l'arrêt d'un processus")
+
+    def _purge(self) -> None:
+        """Oublie les tâches terminées depuis plus de job_ttl (verrou tenu)"""
+        now = time.monotonic()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['future'].done() and now - job['created_at'] > self.job_ttl]:
+            del self._jobs[job_id]
+
+    def submit(self, generation_id: str, filename: str, html_template: str, simple_html: str,
+               response_hash: Optional[str] = None) -> str:
+        """Planifie un rendu ; lève QueueFullError si trop de rendus sont en attente
+
+        `response_hash` (génération terminée) permet de conserver le PDF obtenu.
+        """
+        with self._lock:
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if not job['future'].done())
+            if pending >= self.max_pending:
+                raise QueueFullError(max(1, self.timeout * pending // (self.max_workers * 2)))
+
+            try:
+                future = self._get_executor().submit(render_pdf, html_template, simple_html, self.timeout)
+            except BrokenProcessPool:
+                self._reset_executor()
+                future = self._get_executor().submit(render_pdf, html_template, simple_html, self.timeout)
+
+            job_id = str(uuid.uuid4())
+            self._jobs[job_id] = {
+                'future': future,
+                'generation_id': generation_id,
+                'filename': filename,
+                'response_hash': response_hash,
+                'created_at': time.monotonic()
+            }
+            return job_id
+
+    def result(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """État d'une tâche après au plus `wait` secondes d'attente
+
+        status vaut 'pending', 'done' (avec pdf) ou 'failed' ; None si la
+        tâche est inconnue, expirée ou déjà lue.
+        """
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        result = self._job_result(job_id, job, wait)
+        if result['status'] != 'pending':
+            # Le PDF n'est remis qu'une fois : ne pas le garder en mémoire
+            with self._lock:
+                self._jobs.pop(job_id, None)
+        return result
+
+    def _job_result(self, job_id: str, job: Dict[str, Any], wait: float) -> Dict[str, Any]:
+        """Attend au plus `wait` secondes le résultat d'une tâche"""
+        info = {
+            'job_id': job_id,
+            'generation_id': job['generation_id'],
+            'filename': job['filename'],
+            'response_hash': job['response_hash']
+        }
+        try:
+            pdf_bytes, engine, errors = job['future'].result(timeout=max(0.0, wait))
+        except FutureTimeoutError:
+            return dict(info, status='pending')
+        except PdfRenderTimeout:
+            logger.error(f"Rendu PDF {job_id} interrompu après {self.timeout}s")
+            return dict(info, status='failed')
+        except BrokenProcessPool:
+            logger.error(f"Rendu PDF {job_id}: processus arrêté (limite mémoire ou CPU atteinte)")
+            return dict(info, status='failed')
+        except MemoryError:
+            logger.error(f"Rendu PDF {job_id}: limite mémoire de {self.memory_limit_mb} Mo atteinte")
+            return dict(info, status='failed')
+        except Exception as e:
+            logger.error(f"Rendu PDF {job_id} échoué: {e}")
+            return dict(info, status='failed')
+
+        for error in errors:
+            logger.warning(f"Rendu PDF {job_id}: {error}")
+        if pdf_bytes is None:
+            return dict(info, status='failed')
+        return dict(info, status='done', pdf=pdf_bytes, engine=engine)
+
+    def stats(self) -> Dict[str, int]:
+        """Nombre de tâches en attente et terminées"""
+        with self._lock:
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if not job['future'].done())
+            return {'pending': pending, 'finished': len(self._jobs) - pending, 'workers': self.max_workers}
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache des réponses identiques, indexé par le hash de la requête complète
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def make_cache_key(model: str, prompt: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                   params: Optional[Dict[str, Any]] = None) -> str:
+    """Hash (modèle, prompt, historique, paramètres d'échantillonnage) stocké dans Generation.prompt_hash"""
+    payload = json.dumps({
+        'model': model,
+        'prompt': prompt,
+        'history': conversation_history or [],
+        'params': params or {}
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """LRU en mémoire des réponses complètes, borné en nombre d'entrées et en âge
+
+    Un défaut de cache se rabat sur la table `generations` (dernière
+    génération complétée avec le même prompt_hash et assez récente).
+    """
+
+    def __init__(self, db_manager, max_entries: int = 256, max_age: float = 86400.0):
+        self.db_manager = db_manager
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Réponse en cache pour `key` (mémoire puis base), None si absente ou expirée"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.time() - entry['cached_at'] <= self.max_age:
+                    self._entries.move_to_end(key)
+                    return entry
+                del self._entries[key]
+
+        cached = self.db_manager.find_cached_response(key, self.max_age)
+        if cached is None:
+            return None
+        self.put(key, cached['generation_id'], cached['response'], cached['token_count'], cached['cached_at'])
+        return cached
+
+    def put(self, key: str, generation_id: str, response: str, token_count: int, cached_at: Optional[float] = None) -> None:
+        """Ajoute une réponse complète, en évinçant les entrées les moins récemment utilisées"""
+        entry = {
+            'generation_id': generation_id,
+            'response': response,
+            'token_count': token_count,
+            'cached_at': cached_at if cached_at is not None else time.time()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -1,23 +1,50 @@
 import os
 import logging
-import markdown
 import json
 import io
-from datetime import datetime
-from flask import render_template, request, jsonify, session, redirect, url_for, Response, flash, make_response
+import hashlib
+import click
+from datetime import datetime, timedelta
+from flask import render_template, request, jsonify, session, redirect, url_for, Response, flash, make_response, send_file
 from app import app
+from artifact_store import ExportArtifactStore
 from claude_service import ClaudeService, AVAILABLE_MODELS
+from generation_engine import QueueFullError
+from markdown_cache import EXPORT_EXTENSIONS, SHARE_EXTENSIONS
+from pdf_renderer import PdfRenderPool
 from database import DatabaseManager
 from models import SavedPrompt, CostTracking
 from models_prompts import PRICING_DATA, calculate_cost, get_model_pricing
 from app import db
-from sqlalchemy import func, desc
+from sqlalchemy import func
 
 logger = logging.getLogger(__name__)
 
 # Initialiser les services
 claude_service = ClaudeService()
 db_manager = DatabaseManager()
+pdf_renderer = PdfRenderPool(
+    max_workers=int(os.environ.get('PDF_WORKERS', 2)),
+    max_pending=int(os.environ.get('PDF_MAX_PENDING', 16)),
+    timeout=int(os.environ.get('PDF_TIMEOUT', 60)),
+    memory_limit_mb=int(os.environ.get('PDF_MEMORY_LIMIT_MB', 1024))
+)
+
+artifact_store = ExportArtifactStore(os.environ.get('EXPORT_ARTIFACT_DIR') or os.path.join(app.instance_path, 'exports'))
+
+# Attente maximale (secondes) d'un export PDF avant de renvoyer un job_id à interroger
+PDF_EXPORT_WAIT = float(os.environ.get('PDF_EXPORT_WAIT', 10))
+
+# Durée de cache (secondes) des pages partagées terminées, pour les navigateurs et le proxy
+SHARE_CACHE_MAX_AGE = int(os.environ.get('SHARE_CACHE_MAX_AGE', 86400))
+
+EXPORT_MIMETYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'md': 'text/markdown; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf'
+}
 
 # Authentification supprimée - accès direct
 
@@ -82,36 +109,103 @@ def generator():
         flash('Erreur lors du chargement du générateur.', 'error')
         return redirect(url_for('dashboard'))
 
+def _history_filters() -> dict:
+    """Filtres d'historique lus dans la query string (statut, modèle, dates AAAA-MM-JJ)"""
+    filters = {
+        'status': request.args.get('status') or None,
+        'model_used': request.args.get('model') or None,
+        'date_from': None,
+        'date_to': None
+    }
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    if date_from:
+        filters['date_from'] = datetime.strptime(date_from, '%Y-%m-%d')
+    if date_to:
+        # Borne de fin incluse : jusqu'à la fin de la journée
+        filters['date_to'] = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    return filters
+
+def _history_page(cursor, per_page: int, filters: dict):
+    """Une page d'historique et le curseur de la page suivante (None si dernière page)"""
+    items = db_manager.get_history(limit=per_page + 1, cursor=cursor, **filters)
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = db_manager.encode_history_cursor(items[-1])
+    return items, next_cursor
+
 @app.route('/history')
 
 def history():
     """Page de l'historique"""
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    cursor = request.args.get('cursor') or None
+    filter_args = {key: request.args[key] for key in ('status', 'model', 'date_from', 'date_to') if request.args.get(key)}
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        # Pour simplifier, on récupère tout et on pagine côté client
-        all_history = db_manager.get_history(limit=100)
-        
-        start = (page - 1) * per_page
-        end = start + per_page
-        history_page = all_history[start:end]
-        
-        total = len(all_history)
-        has_prev = page > 1
-        has_next = end < total
+        history_page, next_cursor = _history_page(cursor, per_page, _history_filters())
         
         return render_template('history.html',
                              history=history_page,
-                             page=page,
                              per_page=per_page,
-                             total=total,
-                             has_prev=has_prev,
-                             has_next=has_next)
+                             cursor=cursor,
+                             next_cursor=next_cursor,
+                             filters=filter_args,
+                             models=AVAILABLE_MODELS)
     except Exception as e:
         logger.error(f"Erreur historique: {e}")
         flash('Erreur lors du chargement de l\'historique.', 'error')
-        return render_template('history.html', history=[], page=1, per_page=20, total=0, has_prev=False, has_next=False)
+        return render_template('history.html', history=[], per_page=per_page, cursor=None, next_cursor=None,
+                             filters=filter_args, models=AVAILABLE_MODELS)
+
+@app.route('/api/history')
+
+def api_history():
+    """API d'historique paginée par curseur avec filtres statut, modèle et dates"""
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        try:
+            filters = _history_filters()
+        except ValueError:
+            return jsonify({'error': 'Format de date invalide (attendu AAAA-MM-JJ)'}), 400
+        
+        cursor = request.args.get('cursor') or None
+        if cursor and db_manager.decode_history_cursor(cursor) is None:
+            return jsonify({'error': 'Curseur invalide'}), 400
+        
+        items, next_cursor = _history_page(cursor, limit, filters)
+        return jsonify({
+            'items': items,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+    except Exception as e:
+        logger.error(f"Erreur API historique: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/search')
+
+def api_search():
+    """Recherche plein texte dans les prompts et réponses, classée par pertinence et paginée"""
+    try:
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({'error': 'Paramètre q requis'}), 400
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        page = max(request.args.get('page', 1, type=int), 1)
+        
+        # Une ligne de plus pour savoir s'il existe une page suivante
+        results = db_manager.search_generations(query, limit + 1, (page - 1) * limit)
+        if results is None:
+            return jsonify({'error': 'Recherche plein texte indisponible'}), 503
+        return jsonify({
+            'items': results[:limit],
+            'page': page,
+            'has_more': len(results) > limit
+        })
+    except Exception as e:
+        logger.error(f"Erreur API recherche: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
 
 @app.route('/api/generate', methods=['POST'])
 
@@ -152,9 +246,15 @@ def api_generate():
         logger.info(f"[API] Appel generate_text avec conversation_history: {len(conversation_history) if conversation_history else 0} messages")
         if conversation_history:
             logger.info(f"[API] Historique: {conversation_history}")
-        result = claude_service.generate_text(prompt, model=model, stream=True, conversation_history=conversation_history)
+        result = claude_service.generate_text(prompt, model=model, stream=True, conversation_history=conversation_history,
+                                              params={'temperature': temperature}, use_cache=data.get('cache'))
         return jsonify(result)
         
+    except QueueFullError as e:
+        logger.warning(f"Génération refusée: {e}")
+        response = jsonify({'error': 'Trop de générations en attente, réessayez plus tard', 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
     except Exception as e:
         logger.error(f"Erreur API génération: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
@@ -176,52 +276,125 @@ def api_generation_status(generation_id):
 @app.route('/api/generation/<generation_id>/stream')
 
 def api_generation_stream(generation_id):
-    """API pour streamer une génération en cours"""
+    """API pour streamer une génération en cours
+
+    Chaque chunk porte un champ SSE `id` égal à son chunk_index : à la
+    reconnexion, le navigateur renvoie `Last-Event-ID` et le flux reprend
+    au chunk suivant. La connexion reste ouverte jusqu'au statut final,
+    entretenue par des commentaires de heartbeat.
+
+    Protocole 2 (défaut) : chunks, puis petits événements statut/progrès ;
+    la réponse complète n'est envoyée qu'une fois, avec le statut final.
+    `?protocol=1` conserve l'ancien format qui renvoie la réponse entière
+    à chaque événement de statut.
+    """
+    legacy_protocol = request.args.get('protocol', '2') == '1'
+    
+    # Reprise après reconnexion (en-tête standard ou paramètre explicite)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        resume_index = int(last_event_id) + 1 if last_event_id is not None else 0
+    except ValueError:
+        resume_index = 0
+    
     def generate_stream():
+        # S'abonner avant le rattrapage pour ne manquer aucun événement
+        subscription = claude_service.event_hub.subscribe(generation_id)
         try:
-            last_chunk_index = 0
-            max_iterations = 200  # Limite de sécurité réduite pour éviter timeouts
-            iterations = 0
+            last_chunk_index = max(0, resume_index)
+            heartbeat_interval = 15  # Commentaire SSE pour garder la connexion ouverte
+            status_interval = 0.25  # Fréquence max des événements de progression
             
             import json
             import time
             
-            while iterations < max_iterations:
-                # Vérifier le statut avec retry pour la création
+            def chunk_event(chunk):
+                return f"id: {chunk['chunk_index']}\ndata: {json.dumps({'content': chunk['content'], 'chunk_index': chunk['chunk_index']})}\n\n"
+            
+            def status_event(status):
+                payload = {'status': status['status'], 'progress': status.get('progress', 0)}
+                if legacy_protocol:
+                    payload['response'] = status.get('response', '')
+                elif status['status'] in ['completed', 'error']:
+                    payload.update({
+                        'response': status.get('response', ''),
+                        'token_count': status.get('token_count', 0),
+                        'model_used': status.get('model_used'),
+                        'error_message': status.get('error_message')
+                    })
+                return f"data: {json.dumps(payload)}\n\n"
+            
+            # Vérifier le statut avec retry pour la création
+            status = claude_service.get_generation_status(generation_id)
+            wait_deadline = time.monotonic() + 5
+            while not status and time.monotonic() < wait_deadline:
+                time.sleep(0.1)
                 status = claude_service.get_generation_status(generation_id)
-                if not status and iterations < 50:  # Attendre 5 secondes max pour la création
-                    time.sleep(0.1)
-                    iterations += 1
-                    continue
-                elif not status:
-                    yield f"data: {json.dumps({'error': 'Génération non trouvée'})}\n\n"
-                    break
-                
-                # Récupérer les nouveaux chunks
-                chunks = claude_service.get_stream_chunks(generation_id, last_chunk_index)
-                
-                for chunk in chunks:
-                    yield f"data: {json.dumps({'content': chunk['content'], 'chunk_index': chunk['chunk_index']})}\n\n"
-                    last_chunk_index = max(last_chunk_index, chunk['chunk_index'] + 1)
-                
-                # Envoyer le statut et progrès
-                yield f"data: {json.dumps({'status': status['status'], 'progress': status.get('progress', 0), 'response': status.get('response', '')})}\n\n"
+            if not status:
+                yield f"data: {json.dumps({'error': 'Génération non trouvée'})}\n\n"
+                return
+            
+            # Délai de reconnexion conseillé au navigateur (ms)
+            yield "retry: 3000\n\n"
+            
+            resync = True  # Rattrapage depuis la base à la connexion
+            while True:
+                if resync:
+                    subscription.reset()
+                    status = claude_service.get_generation_status(generation_id) or status
+                    for chunk in claude_service.get_stream_chunks(generation_id, last_chunk_index):
+                        yield chunk_event(chunk)
+                        last_chunk_index = max(last_chunk_index, chunk['chunk_index'] + 1)
+                    yield status_event(status)
+                    last_event_sent = time.monotonic()
+                    resync = False
                 
-                # Si terminé, arrêter immédiatement
                 if status['status'] in ['completed', 'error']:
-                    logger.info(f"Stream terminé pour {generation_id}: {status['status']}")
                     break
                 
-                # Attendre avant la prochaine itération
-                time.sleep(0.05)  # Délai réduit pour éviter les timeouts
-                iterations += 1
+                event = subscription.get(timeout=1.0)
+                if event is None:
+                    if time.monotonic() - last_event_sent >= heartbeat_interval:
+                        yield ": heartbeat\n\n"
+                        last_event_sent = time.monotonic()
+                    # Sans producteur local (autre processus), se rabattre sur la base
+                    resync = generation_id not in claude_service.active_generations
+                    continue
+                
+                # Traiter tous les événements déjà disponibles, un seul statut par lot
+                status_changed = False
+                while event is not None:
+                    if event['type'] == 'chunk' and event['chunk_index'] >= last_chunk_index:
+                        yield chunk_event(event)
+                        last_chunk_index = event['chunk_index'] + 1
+                    elif event['type'] == 'status':
+                        status_changed = status_changed or event['status'] != status['status']
+                        status = dict(status, progress=event['progress'])
+                    event = subscription.get(timeout=0)
+                
+                if subscription.overflowed or status_changed:
+                    # Lecteur débordé ou transition : repartir de l'état en base, qui
+                    # contient tous les chunks écrits avant le statut final
+                    resync = True
+                elif time.monotonic() - last_event_sent >= status_interval:
+                    if legacy_protocol:
+                        # L'ancien format a besoin de la réponse accumulée
+                        status = claude_service.get_generation_status(generation_id) or status
+                    if status['status'] in ['completed', 'error']:
+                        resync = True
+                    else:
+                        yield status_event(status)
+                        last_event_sent = time.monotonic()
             
+            logger.info(f"Stream terminé pour {generation_id}: {status['status']}")
             yield f"data: {json.dumps({'status': 'stream_ended'})}\n\n"
             
         except Exception as e:
             logger.error(f"Erreur stream: {e}")
             import json
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            claude_service.event_hub.unsubscribe(subscription)
     
     return Response(generate_stream(), mimetype='text/event-stream',
                    headers={'Cache-Control': 'no-cache',
@@ -238,14 +411,60 @@ def api_stats():
         logger.error(f"Erreur API stats: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
 
+_templates_digest = None
+
+def _templates_version() -> str:
+    """Hash du contenu des templates, calculé une fois par processus"""
+    global _templates_digest
+    if _templates_digest is None:
+        digest = hashlib.md5()
+        for root, dirs, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+            dirs.sort()
+            for name in sorted(files):
+                with open(os.path.join(root, name), 'rb') as f:
+                    digest.update(f.read())
+        _templates_digest = digest.hexdigest()
+    return _templates_digest
+
+def _generation_etag(version, variant: str):
+    """ETag fort d'une génération terminée, None tant qu'elle peut encore changer
+
+    `variant` distingue les représentations (JSON, pages) ; les pages
+    dépendent aussi du contenu des templates.
+    """
+    if not version or version['status'] != 'completed' or not version['response_hash']:
+        return None
+    key = json.dumps([variant, _templates_version(), version], sort_keys=True, default=str)
+    return hashlib.md5(key.encode()).hexdigest()
+
+def _not_modified(etag, cache_control: str):
+    """Réponse 304 si le client possède déjà cette version (If-None-Match)"""
+    if etag and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    return None
+
+def _with_etag(response, etag, cache_control: str):
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+    return response
+
 @app.route('/api/generation/<generation_id>')
 
 def api_get_generation(generation_id):
     """API pour récupérer une génération complète"""
     try:
+        etag = _generation_etag(db_manager.get_generation_version(generation_id=generation_id), 'api')
+        not_modified = _not_modified(etag, 'private, no-cache')
+        if not_modified:
+            return not_modified
+        
         generation = db_manager.get_generation_by_id(generation_id)
         if generation:
-            return jsonify(generation)
+            return _with_etag(jsonify(generation), etag, 'private, no-cache')
         else:
             return jsonify({'error': 'Génération non trouvée'}), 404
     except Exception as e:
@@ -259,6 +478,8 @@ def api_delete_generation(generation_id):
     try:
         success = db_manager.delete_generation(generation_id)
         if success:
+            claude_service.markdown_cache.discard(generation_id)
+            artifact_store.discard(generation_id)
             return jsonify({'message': 'Génération supprimée avec succès'})
         else:
             return jsonify({'error': 'Génération non trouvée'}), 404
@@ -467,32 +688,20 @@ def api_get_costs():
         else:  # 'all'
             start_date = datetime(2020, 1, 1)
         
-        # Récupérer les données de coût
-        costs_query = CostTracking.query.filter(CostTracking.created_at >= start_date)
-        cost_records = costs_query.all()
+        # Bornes à minuit : les totaux (cumuls journaliers) et les générations
+        # les plus coûteuses (cost_tracking) couvrent ainsi la même fenêtre
+        start_date = db_manager.cost_period_start(start_date)
+        month_start = db_manager.cost_period_start(now - timedelta(days=30))
         
-        # Calculer le résumé
-        total_cost = sum(record.total_cost for record in cost_records)
-        month_start = now - timedelta(days=30)
-        month_costs = [r for r in cost_records if r.created_at >= month_start]
-        month_cost = sum(record.total_cost for record in month_costs)
+        # Agrégats calculés par la base (GROUP BY)
+        aggregates = db_manager.get_cost_aggregates(start_date, month_start)
+        total_cost = aggregates['total_cost']
+        month_cost = aggregates['month_cost']
         
         # Données par modèle
         model_costs = {}
-        for record in cost_records:
-            if record.model_id not in model_costs:
-                model_costs[record.model_id] = {
-                    'model_name': record.model_name,
-                    'provider': record.provider,
-                    'total_cost': 0.0,
-                    'input_tokens': 0,
-                    'output_tokens': 0,
-                    'count': 0
-                }
-            model_costs[record.model_id]['total_cost'] += record.total_cost
-            model_costs[record.model_id]['input_tokens'] += record.input_tokens
-            model_costs[record.model_id]['output_tokens'] += record.output_tokens
-            model_costs[record.model_id]['count'] += 1
+        for model in aggregates['by_model']:
+            model_costs[model.pop('model_id')] = model
         
         # Convertir en liste et calculer pourcentages
         model_list = list(model_costs.values())
@@ -501,34 +710,19 @@ def api_get_costs():
             model['percentage'] = (model['total_cost'] / max_cost) * 100 if max_cost > 0 else 0
         
         # Données par fournisseur
-        provider_costs = {}
-        for record in cost_records:
-            if record.provider not in provider_costs:
-                provider_costs[record.provider] = 0.0
-            provider_costs[record.provider] += record.total_cost
-        
-        provider_list = [{'provider': k, 'total_cost': v} for k, v in provider_costs.items()]
+        provider_list = aggregates['by_provider']
         
-        # Timeline (par jour)
-        timeline_data = {}
-        for record in cost_records:
-            date_key = record.created_at.strftime('%Y-%m-%d')
-            if date_key not in timeline_data:
-                timeline_data[date_key] = 0.0
-            timeline_data[date_key] += record.total_cost
-        
-        # Trier par date
-        sorted_timeline = sorted(timeline_data.items())
+        # Timeline (par jour, déjà triée par date)
         timeline = {
-            'labels': [item[0] for item in sorted_timeline],
-            'costs': [item[1] for item in sorted_timeline]
+            'labels': [item[0] for item in aggregates['timeline']],
+            'costs': [item[1] for item in aggregates['timeline']]
         }
         
         # Table de tarification avec usage
         pricing_table = []
         for model_id, pricing in PRICING_DATA.items():
             usage_count = model_costs.get(model_id, {}).get('count', 0)
-            total_cost = model_costs.get(model_id, {}).get('total_cost', 0.0)
+            model_total_cost = model_costs.get(model_id, {}).get('total_cost', 0.0)
             
             # Convertir les prix de $/1M tokens vers $/1K tokens pour l'affichage
             input_price_1k = pricing['input_cost'] / 1000  # De $/1M vers $/1K
@@ -542,34 +736,19 @@ def api_get_costs():
                 'output_price': output_price_1k,
                 'context_window': pricing['context_window'],
                 'usage_count': usage_count,
-                'total_cost': total_cost
+                'total_cost': model_total_cost
             })
         
-        # Générations les plus coûteuses
-        expensive_query = costs_query.order_by(desc(CostTracking.total_cost)).limit(5)
-        expensive_generations = []
-        for record in expensive_query:
-            # Récupérer le prompt associé
-            generation = db_manager.get_generation_by_id(record.generation_id)
-            prompt_preview = generation.get('prompt', '')[:100] if generation else ''
-            
-            expensive_generations.append({
-                'generation_id': record.generation_id,
-                'model_name': record.model_name,
-                'provider': record.provider,
-                'input_tokens': record.input_tokens,
-                'output_tokens': record.output_tokens,
-                'total_cost': record.total_cost,
-                'created_at': record.created_at.isoformat(),
-                'prompt_preview': prompt_preview
-            })
+        # Générations les plus coûteuses (top N configurable, une seule jointure)
+        top = min(max(request.args.get('top', 5, type=int), 1), 100)
+        expensive_generations = db_manager.get_most_expensive_generations(start_date, limit=top)
         
         return jsonify({
             'status': 'success',
             'summary': {
                 'total_cost': total_cost,
                 'month_cost': month_cost,
-                'total_generations': len(cost_records)
+                'total_generations': aggregates['count']
             },
             'timeline': timeline,
             'by_model': model_list,
@@ -602,6 +781,7 @@ def api_export_costs():
         else:
             start_date = datetime(2020, 1, 1)
         
+        start_date = db_manager.cost_period_start(start_date)
         costs_query = CostTracking.query.filter(CostTracking.created_at >= start_date)
         cost_records = costs_query.all()
         
@@ -650,6 +830,11 @@ def api_export_costs():
 def playground(generation_id):
     """Page playground pour analyser une génération"""
     try:
+        etag = _generation_etag(db_manager.get_generation_version(generation_id=generation_id), 'playground')
+        not_modified = _not_modified(etag, 'private, no-cache')
+        if not_modified:
+            return not_modified
+        
         generation = db_manager.get_generation_by_id(generation_id)
         if not generation:
             flash('Génération non trouvée', 'error')
@@ -672,7 +857,7 @@ def playground(generation_id):
             'status': generation.get('status', 'completed')
         }
         
-        return render_template('playground.html', generation=generation_dict)
+        return _with_etag(make_response(render_template('playground.html', generation=generation_dict)), etag, 'private, no-cache')
     
     except Exception as e:
         logger.error(f"Erreur page playground: {e}")
@@ -703,7 +888,13 @@ def api_generate_share_token(generation_id):
 @app.route('/share/<share_token>')
 def shared_generation(share_token):
     """Page publique pour afficher une génération partagée"""
+    share_cache_control = f'public, max-age={SHARE_CACHE_MAX_AGE}'
     try:
+        etag = _generation_etag(db_manager.get_generation_version(share_token=share_token), 'share')
+        not_modified = _not_modified(etag, share_cache_control)
+        if not_modified:
+            return not_modified
+        
         generation = db_manager.get_generation_by_share_token(share_token)
         if not generation:
             return render_template('error.html', 
@@ -718,7 +909,7 @@ def shared_generation(share_token):
             created_at = datetime.utcnow()
         
         # Conversion du Markdown en HTML
-        response_html = markdown.markdown(generation.get('response', ''), extensions=['codehilite', 'fenced_code'])
+        response_html = claude_service.markdown_cache.render(generation['id'], generation.get('response', ''), SHARE_EXTENSIONS)
         
         generation_data = {
             'id': generation.get('id'),
@@ -732,7 +923,7 @@ def shared_generation(share_token):
             'share_token': share_token
         }
         
-        return render_template('shared.html', generation=generation_data)
+        return _with_etag(make_response(render_template('shared.html', generation=generation_data)), etag, share_cache_control)
         
     except Exception as e:
         logger.error(f"Erreur affichage génération partagée: {e}")
@@ -747,6 +938,17 @@ def shared_generation(share_token):
 def api_export_generation(generation_id, format):
     """Exporter une génération dans différents formats"""
     try:
+        # Une génération terminée ne change plus : ses exports sont construits une seule
+        # fois, puis servis d'après le response_hash enregistré sans relire prompt ni réponse
+        version = db_manager.get_generation_version(generation_id)
+        if not version:
+            return jsonify({'status': 'error', 'message': 'Génération non trouvée'}), 404
+        filename = f"generation_{generation_id[:8]}"
+        if version['status'] == 'completed' and version['response_hash'] and format in EXPORT_MIMETYPES:
+            artifact_path = artifact_store.get(generation_id, format, version['response_hash'])
+            if artifact_path:
+                return _send_export_artifact(artifact_path, format, filename)
+        
         generation = db_manager.get_generation_by_id(generation_id)
         if not generation:
             return jsonify({'status': 'error', 'message': 'Génération non trouvée'}), 404
@@ -768,7 +970,11 @@ def api_export_generation(generation_id, format):
         content = generation.get('response', '')
         model_used = generation.get('model_used', 'Claude')
         token_count = generation.get('token_count', 0)
-        filename = f"generation_{generation_id[:8]}"
+        
+        # Hash enregistré (calculé au chargement pour les lignes anciennes) : clé de l'artefact à construire
+        response_hash = None
+        if generation.get('status') == 'completed' and format in EXPORT_MIMETYPES:
+            response_hash = generation.get('response_hash')
         
         # Export TXT (texte brut)
         if format == 'txt':
@@ -785,10 +991,7 @@ PROMPT:
 RÉPONSE:
 {content}
 """
-            response = make_response(txt_content)
-            response.headers['Content-Type'] = 'text/plain; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}.txt"'
-            return response
+            return _export_response(generation_id, 'txt', txt_content, filename, response_hash)
         
         # Export MD (Markdown avec métadonnées)
         elif format == 'md':
@@ -815,10 +1018,7 @@ RÉPONSE:
 
 *Généré avec AI Playground - Plateforme d'analyse et manipulation de contenu IA*
 """
-            response = make_response(md_content)
-            response.headers['Content-Type'] = 'text/markdown; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}.md"'
-            return response
+            return _export_response(generation_id, 'md', md_content, filename, response_hash)
         
         # Export JSON (données structurées)
         elif format == 'json':
@@ -843,15 +1043,12 @@ RÉPONSE:
                 }
             }
             
-            response = make_response(json.dumps(json_data, ensure_ascii=False, indent=2))
-            response.headers['Content-Type'] = 'application/json; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}.json"'
-            return response
+            return _export_response(generation_id, 'json', json.dumps(json_data, ensure_ascii=False, indent=2), filename, response_hash)
         
         # Export HTML (page formatée)
         elif format == 'html':
             # Conversion du Markdown en HTML
-            response_html = markdown.markdown(content, extensions=['codehilite', 'fenced_code', 'tables'])
+            response_html = claude_service.markdown_cache.render(generation_id, content, EXPORT_EXTENSIONS)
             
             html_content = f"""<!DOCTYPE html>
 <html lang="fr">
@@ -985,16 +1182,13 @@ RÉPONSE:
 </body>
 </html>"""
             
-            response = make_response(html_content)
-            response.headers['Content-Type'] = 'text/html; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}.html"'
-            return response
+            return _export_response(generation_id, 'html', html_content, filename, response_hash)
         
-        # Export PDF (via WeasyPrint ou xhtml2pdf en fallback)
+        # Export PDF (WeasyPrint puis xhtml2pdf, rendu dans le pool de processus)
         elif format == 'pdf':
             try:
                 # Conversion du Markdown en HTML
-                response_html = markdown.markdown(content, extensions=['codehilite', 'fenced_code', 'tables'])
+                response_html = claude_service.markdown_cache.render(generation_id, content, EXPORT_EXTENSIONS)
                 
                 # Template HTML simplifié pour le PDF
                 html_template = f"""<!DOCTYPE html>
@@ -1101,30 +1295,10 @@ RÉPONSE:
     </div>
 </body>
 </html>"""
+
                 
-                # Essayer WeasyPrint d'abord
-                try:
-                    import weasyprint
-                    pdf_bytes = weasyprint.HTML(string=html_template).write_pdf()
-                    
-                    response = make_response(pdf_bytes)
-                    response.headers['Content-Type'] = 'application/pdf'
-                    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.pdf"'
-                    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                    response.headers['Pragma'] = 'no-cache'
-                    response.headers['Expires'] = '0'
-                    return response
-                    
-                except Exception as weasy_error:
-                    logger.warning(f"WeasyPrint échoué: {weasy_error}, essai avec xhtml2pdf")
-                    
-                    # Fallback vers xhtml2pdf
-                    try:
-                        from xhtml2pdf import pisa
-                        from io import BytesIO
-                        
-                        # Template simplifié pour xhtml2pdf
-                        simple_html = f"""<!DOCTYPE html>
+                # Template simplifié pour xhtml2pdf
+                simple_html = f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
@@ -1152,39 +1326,20 @@ RÉPONSE:
     </div>
 </body>
 </html>"""
-                        
-                        pdf_buffer = BytesIO()
-                        pisa_status = pisa.CreatePDF(simple_html, dest=pdf_buffer)
-                        
-                        if hasattr(pisa_status, 'err') and pisa_status.err:
-                            raise Exception("Erreur xhtml2pdf")
-                        
-                        pdf_bytes = pdf_buffer.getvalue()
-                        pdf_buffer.close()
-                        
-                        response = make_response(pdf_bytes)
-                        response.headers['Content-Type'] = 'application/pdf'
-                        response.headers['Content-Disposition'] = f'attachment; filename="{filename}.pdf"'
-                        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                        response.headers['Pragma'] = 'no-cache'
-                        response.headers['Expires'] = '0'
-                        return response
-                        
-                    except Exception as xhtml_error:
-                        logger.error(f"xhtml2pdf échoué aussi: {xhtml_error}")
-                        # Fallback final vers HTML
-                        return redirect(url_for('api_export_generation', generation_id=generation_id, format='html'))
                 
-            except ImportError:
-                # Fallback vers HTML si aucune librairie PDF n'est disponible
-                logger.warning("Aucune librairie PDF disponible, fallback vers HTML")
-                return redirect(url_for('api_export_generation', generation_id=generation_id, format='html'))
+                job_id = pdf_renderer.submit(generation_id, filename, html_template, simple_html, response_hash)
+            except QueueFullError as e:
+                response = jsonify({'status': 'error', 'message': 'Trop d\'exports PDF en cours, réessayez plus tard', 'retry_after': e.retry_after})
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, 429
             except Exception as e:
                 logger.error(f"Erreur export PDF: {e}")
                 return jsonify({
                     'status': 'error', 
                     'message': f'Export PDF temporairement indisponible. Utilisez le format HTML.'
                 }), 500
+            
+            return _pdf_job_response(job_id, _pdf_wait(PDF_EXPORT_WAIT))
         
         else:
             return jsonify({'status': 'error', 'message': f'Format "{format}" non supporté. Formats disponibles: txt, md, html, json, pdf'}), 400
@@ -1193,6 +1348,72 @@ RÉPONSE:
         logger.error(f"Erreur export génération: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def _send_export_artifact(artifact_path: str, format: str, filename: str):
+    """Sert un export depuis le disque (ETag, If-None-Match et Range gérés par send_file)"""
+    response = send_file(
+        artifact_store.absolute_path(artifact_path),
+        as_attachment=True,
+        download_name=f"{filename}.{format}",
+        conditional=True,
+        etag=True
+    )
+    response.headers['Content-Type'] = EXPORT_MIMETYPES[format]
+    return response
+
+def _export_response(generation_id: str, format: str, content, filename: str, response_hash=None):
+    """Enregistre l'export d'une génération terminée puis le sert depuis le disque"""
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    if response_hash:
+        artifact_path = artifact_store.put(generation_id, format, response_hash, data)
+        if artifact_path:
+            if format in ('txt', 'md'):
+                db_manager.set_export_file(generation_id, format, artifact_path)
+            return _send_export_artifact(artifact_path, format, filename)
+    
+    response = make_response(data)
+    response.headers['Content-Type'] = EXPORT_MIMETYPES[format]
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{format}"'
+    if format == 'pdf':
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    return response
+
+def _pdf_wait(default: float) -> float:
+    """Attente demandée via ?wait=, bornée à PDF_EXPORT_WAIT"""
+    wait = request.args.get('wait', default, type=float)
+    return max(0.0, min(wait if wait is not None else default, PDF_EXPORT_WAIT))
+
+def _pdf_job_response(job_id: str, wait: float):
+    """PDF rendu, 202 avec l'URL de suivi si le rendu continue, ou repli HTML"""
+    job = pdf_renderer.result(job_id, wait)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Export PDF introuvable ou expiré'}), 404
+    
+    if job['status'] == 'pending':
+        status_url = url_for('api_pdf_export_job', job_id=job_id)
+        response = jsonify({'status': 'pending', 'job_id': job_id, 'status_url': status_url})
+        response.headers['Location'] = status_url
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    
+    if job['status'] == 'failed':
+        # Fallback final vers HTML
+        logger.warning(f"Export PDF {job_id} impossible, fallback vers HTML")
+        return redirect(url_for('api_export_generation', generation_id=job['generation_id'], format='html'))
+    
+    return _export_response(job['generation_id'], 'pdf', job['pdf'], job['filename'], job['response_hash'])
+
+@app.route('/api/export/pdf/<job_id>')
+
+def api_pdf_export_job(job_id):
+    """Suivi d'un export PDF rendu en arrière-plan"""
+    try:
+        return _pdf_job_response(job_id, _pdf_wait(0))
+    except Exception as e:
+        logger.error(f"Erreur suivi export PDF: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 # =============================================================================
 # GESTION DES CLÉS API
 # =============================================================================
@@ -1391,3 +1612,41 @@ def api_delete_key(provider):
     except Exception as e:
         logger.error(f"Erreur suppression clé: {e}")
         return jsonify({'error': 'Erreur lors de la suppression'}), 500
+
+@app.cli.command('backfill-cost-rollup')
+
+def backfill_cost_rollup():
+    """Reconstruire les cumuls journaliers de coûts à partir de l'historique"""
+    rows = db_manager.rebuild_cost_rollup()
+    print(f"{rows} lignes de cumul journalier reconstruites")
+
+@app.cli.command('compact-stream-buffer')
+
+def compact_stream_buffer():
+    """Compacter les chunks de stream des générations déjà terminées"""
+    generations, rows = db_manager.compact_finished_stream_chunks()
+    print(f"{rows} chunks compactés pour {generations} générations")
+
+@app.cli.command('rebuild-search-index')
+@click.option('--batch-size', default=500, show_default=True, help='Générations indexées par transaction')
+
+def rebuild_search_index(batch_size):
+    """Indexer toutes les générations terminées pour la recherche plein texte"""
+    try:
+        indexed = db_manager.rebuild_search_index(batch_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    print(f"{indexed} générations indexées")
+
+@app.cli.command('compress-generations')
+@click.option('--batch-size', default=200, show_default=True, help='Générations réécrites par transaction')
+
+def compress_generations(batch_size):
+    """Compresser les prompts et réponses déjà stockés en clair (TEXT_COMPRESSION requis)"""
+    try:
+        scanned, rewritten = db_manager.compress_existing_texts(batch_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    print(f"{rewritten} générations compressées sur {scanned} examinées")
+    if db.engine.dialect.name == 'sqlite':
+        print("Exécuter VACUUM sur la base SQLite pour récupérer l'espace libéré")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index plein texte des prompts et réponses : FTS5 sous SQLite, tsvector et
+index GIN sous PostgreSQL
+"""
+
+import html
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Configuration de recherche PostgreSQL ('simple', 'french', 'english'...)
+SEARCH_TS_CONFIG = os.environ.get('SEARCH_TS_CONFIG', 'simple')
+SNIPPET_TOKENS = int(os.environ.get('SEARCH_SNIPPET_TOKENS', 24))
+MAX_QUERY_TERMS = 16
+# PostgreSQL : début du texte clair conservé dans l'index pour calculer les extraits en SQL
+SNIPPET_SOURCE_CHARS = int(os.environ.get('SEARCH_SNIPPET_SOURCE_CHARS', 4000))
+
+# Délimiteurs des termes trouvés dans les extraits, remplacés par <mark> après échappement HTML
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+# 'fts5', 'tsvector' ou None si l'index n'est pas disponible sur cette base
+_backend: Optional[str] = None
+
+
+def ensure_search_index(engine) -> Optional[str]:
+    """Crée les tables de l'index si besoin ; retourne le backend utilisé"""
+    global _backend
+    try:
+        with engine.begin() as connection:
+            if engine.dialect.name == 'sqlite':
+                created = not _table_exists(connection, 'generation_search')
+                # Les ids de génération sont des UUID : la table docs fournit le rowid entier de FTS5
+                connection.exec_driver_sql(
+                    'CREATE TABLE IF NOT EXISTS generation_search_docs ('
+                    'docid INTEGER PRIMARY KEY, generation_id VARCHAR(36) NOT NULL UNIQUE)'
+                )
+                connection.exec_driver_sql(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS generation_search USING fts5("
+                    "prompt, response, tokenize='unicode61 remove_diacritics 2')"
+                )
+                if created:
+                    # Classement par défaut (colonne rank) : le prompt pèse double
+                    connection.exec_driver_sql(
+                        "INSERT INTO generation_search (generation_search, rank) VALUES ('rank', 'bm25(2.0, 1.0)')"
+                    )
+                backend = 'fts5'
+            elif engine.dialect.name == 'postgresql':
+                created = not _table_exists(connection, 'generation_search')
+                # excerpt : les colonnes de generations peuvent être compressées, ts_headline
+                # travaille donc sur un extrait en clair de taille bornée
+                connection.exec_driver_sql(
+                    'CREATE TABLE IF NOT EXISTS generation_search ('
+                    'generation_id VARCHAR(36) PRIMARY KEY REFERENCES generations (id) ON DELETE CASCADE, '
+                    'document tsvector NOT NULL, excerpt TEXT)'
+                )
+                connection.exec_driver_sql('ALTER TABLE generation_search ADD COLUMN IF NOT EXISTS excerpt TEXT')
+                connection.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_generation_search_document ON generation_search USING GIN (document)'
+                )
+                backend = 'tsvector'
+            else:
+                logger.warning(f"Recherche plein texte non disponible pour {engine.dialect.name}")
+                _backend = None
+                return None
+        if created:
+            logger.info("Index de recherche créé ; exécuter `flask rebuild-search-index` pour indexer l'existant")
+        _backend = backend
+    except Exception as e:
+        logger.warning(f"Index de recherche plein texte indisponible: {e}")
+        _backend = None
+    return _backend
+
+
+def _table_exists(connection, name: str) -> bool:
+    return inspect(connection).has_table(name)
+
+
+def search_backend() -> Optional[str]:
+    return _backend
+
+
+def index_generation(session, generation_id: str, prompt: str, response: str) -> None:
+    """Indexe (ou réindexe) le texte clair d'une génération dans la transaction de `session`"""
+    if _backend == 'fts5':
+        docid = session.execute(
+            text('SELECT docid FROM generation_search_docs WHERE generation_id = :generation_id'),
+            {'generation_id': generation_id}
+        ).scalar()
+        if docid is None:
+            docid = session.execute(
+                text('INSERT INTO generation_search_docs (generation_id) VALUES (:generation_id)'),
+                {'generation_id': generation_id}
+            ).lastrowid
+        else:
+            session.execute(text('DELETE FROM generation_search WHERE rowid = :docid'), {'docid': docid})
+        session.execute(
+            text('INSERT INTO generation_search (rowid, prompt, response) VALUES (:docid, :prompt, :response)'),
+            {'docid': docid, 'prompt': prompt or '', 'response': response or ''}
+        )
+    elif _backend == 'tsvector':
+        session.execute(
+            text(
+                'INSERT INTO generation_search (generation_id, document, excerpt) VALUES (:generation_id, '
+                "setweight(to_tsvector(CAST(:config AS regconfig), :prompt), 'A') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :response), 'B'), :excerpt) "
+                'ON CONFLICT (generation_id) DO UPDATE SET document = EXCLUDED.document, excerpt = EXCLUDED.excerpt'
+            ),
+            {'generation_id': generation_id, 'config': SEARCH_TS_CONFIG,
+             'prompt': prompt or '', 'response': response or '',
+             'excerpt': f"{prompt or ''}\n\n{response or ''}"[:SNIPPET_SOURCE_CHARS]}
+        )
+
+
+def remove_generation(session, generation_id: str) -> None:
+    """Retire une génération de l'index (PostgreSQL : supprimée en cascade)"""
+    if _backend == 'fts5':
+        docid = session.execute(
+            text('SELECT docid FROM generation_search_docs WHERE generation_id = :generation_id'),
+            {'generation_id': generation_id}
+        ).scalar()
+        if docid is not None:
+            session.execute(text('DELETE FROM generation_search WHERE rowid = :docid'), {'docid': docid})
+            session.execute(text('DELETE FROM generation_search_docs WHERE docid = :docid'), {'docid': docid})
+
+
+def _fts5_query(query: str) -> Optional[str]:
+    """Requête FTS5 sûre : termes entre guillemets, le dernier en préfixe (saisie en cours)"""
+    terms = re.findall(r'\w+', query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def search(session, query: str, limit: int, offset: int = 0) -> Optional[List[Dict[str, Any]]]:
+    """Générations correspondant à `query`, par pertinence décroissante
+
+    Chaque résultat contient generation_id, score et snippet (extrait brut,
+    termes trouvés entre délimiteurs : voir `highlight`). Retourne None si
+    l'index n'est pas disponible.
+    """
+    if _backend == 'fts5':
+        match = _fts5_query(query)
+        if match is None:
+            return []
+        rows = session.execute(
+            text(
+                'SELECT d.generation_id, generation_search.rank AS score, '
+                'snippet(generation_search, -1, char(2), char(3), :ellipsis, :tokens) AS snippet '
+                'FROM generation_search JOIN generation_search_docs d ON d.docid = generation_search.rowid '
+                'WHERE generation_search MATCH :match ORDER BY generation_search.rank LIMIT :limit OFFSET :offset'
+            ),
+            {'match': match, 'ellipsis': '…', 'tokens': SNIPPET_TOKENS, 'limit': limit, 'offset': offset}
+        ).all()
+        # bm25 est négatif, plus petit = plus pertinent
+        return [{'generation_id': row.generation_id, 'score': -row.score, 'snippet': row.snippet} for row in rows]
+
+    if _backend == 'tsvector':
+        if not query.strip():
+            return []
+        # ts_headline n'est calculé que pour la page retenue par le classement
+        rows = session.execute(
+            text(
+                'WITH hits AS ('
+                'SELECT s.generation_id, s.excerpt, q, ts_rank_cd(s.document, q) AS score '
+                'FROM generation_search s, websearch_to_tsquery(CAST(:config AS regconfig), :query) q '
+                'WHERE s.document @@ q ORDER BY score DESC, s.generation_id LIMIT :limit OFFSET :offset) '
+                'SELECT generation_id, score, '
+                "ts_headline(CAST(:config AS regconfig), coalesce(excerpt, ''), q, :options) AS snippet "
+                'FROM hits ORDER BY score DESC, generation_id'
+            ),
+            {'config': SEARCH_TS_CONFIG, 'query': query, 'limit': limit, 'offset': offset,
+             'options': f'StartSel="{_MARK_START}", StopSel="{_MARK_END}", MaxWords={SNIPPET_TOKENS}, '
+                        f'MinWords={SNIPPET_TOKENS // 2}, MaxFragments=2, FragmentDelimiter=" … "'}
+        ).all()
+        return [{'generation_id': row.generation_id, 'score': row.score, 'snippet': row.snippet} for row in rows]
+
+    return None
+
+
+def highlight(snippet: Optional[str]) -> str:
+    """Extrait échappé pour HTML, termes trouvés entre <mark>"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
@@ -533,6 +533,12 @@ function startGenerationStreaming(generationId, startTime) {
             if (data.status === 'completed' || data.status === 'error') {
                 handleGenerationStatus(data.status, generationId, startTime);
             }
+            
+            // Fin du flux : fermer avant que le navigateur ne se reconnecte
+            if (data.status === 'stream_ended') {
+                eventSource.close();
+                AppState.activeStreams.delete(generationId);
+            }
 
         } catch (error) {
             console.error('Erreur parsing streaming:', error, 'Raw data:', event.data);
@@ -540,6 +546,11 @@ function startGenerationStreaming(generationId, startTime) {
     };
 
     eventSource.onerror = function(event) {
+        // Le navigateur se reconnecte seul et reprend grâce à Last-Event-ID
+        if (eventSource.readyState === EventSource.CONNECTING) {
+            console.warn('Connexion streaming perdue, reconnexion en cours pour:', generationId);
+            return;
+        }
         console.error('Erreur EventSource:', event);
         eventSource.close();
         AppState.activeStreams.delete(generationId);
@@ -1140,7 +1151,14 @@ async function exportGeneration(generationId, format) {
         const downloadUrl = `/api/generation/${generationId}/export/${format}`;
         
         // Méthode robuste de téléchargement avec fetch
-        const response = await fetch(downloadUrl);
+        let response = await fetch(downloadUrl);
+        
+        // Rendu PDF encore en cours : interroger la tâche jusqu'au résultat
+        while (response.status === 202) {
+            const job = await response.json();
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            response = await fetch(`${job.status_url}?wait=5`);
+        }
         
         if (!response.ok) {
             throw new Error(`Erreur HTTP: ${response.status}`);
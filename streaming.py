@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Structures en mémoire pour le suivi des générations en cours
+"""
+
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Champs renvoyés par l'API de statut, ceux de DatabaseManager.get_generation_by_id
+PUBLIC_FIELDS = (
+    'id', 'prompt', 'response', 'status', 'timestamp', 'started_at', 'completed_at',
+    'token_count', 'progress', 'txt_file', 'md_file', 'error_message', 'model_used',
+    'share_token', 'response_hash'
+)
+
+
+class LiveGenerationStore:
+    """État en mémoire des générations en cours (statut, progrès, réponse accumulée)
+
+    Les producteurs de ClaudeService mettent à jour cet état à chaque delta ;
+    la ligne Generation n'est réécrite qu'aux transitions de statut et aux
+    checkpoints décidés par l'appelant.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+
+    def __contains__(self, generation_id: str) -> bool:
+        with self._lock:
+            return generation_id in self._states
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._states)
+
+    def start(self, generation_id: str, prompt: str, model: str, **fields) -> None:
+        """Enregistre une nouvelle génération en cours"""
+        now = datetime.utcnow()
+        state = {
+            'id': generation_id,
+            'prompt': prompt,
+            'status': 'starting',
+            'timestamp': now,
+            'started_at': now,
+            'completed_at': None,
+            'token_count': 0,
+            'progress': 0.0,
+            'error_message': None,
+            'model_used': model,
+            'parts': [],
+            'last_checkpoint': 0.0,
+        }
+        if 'response' in fields:
+            state['parts'] = [fields.pop('response')]
+        state.update(fields)
+        with self._lock:
+            self._states[generation_id] = state
+
+    def update(self, generation_id: str, append: Optional[str] = None, **fields) -> Optional[bool]:
+        """Met à jour l'état d'une génération
+
+        `append` est ajouté à la réponse accumulée ; `response` la remplace.
+        Retourne True si le statut a changé, False sinon, None si la
+        génération n'est pas suivie.
+        """
+        with self._lock:
+            state = self._states.get(generation_id)
+            if state is None:
+                return None
+            if 'response' in fields:
+                state['parts'] = [fields.pop('response')]
+            if append:
+                state['parts'].append(append)
+            status_changed = 'status' in fields and fields['status'] != state['status']
+            state.update(fields)
+            state['timestamp'] = datetime.utcnow()
+            return status_changed
+
+    def checkpoint_due(self, generation_id: str, interval: float) -> bool:
+        """Indique si le dernier checkpoint date de plus de `interval` secondes"""
+        with self._lock:
+            state = self._states.get(generation_id)
+            if state is None:
+                return False
+            return time.monotonic() - state['last_checkpoint'] >= interval
+
+    def mark_checkpointed(self, generation_id: str) -> None:
+        """Note l'heure du dernier checkpoint en base"""
+        with self._lock:
+            state = self._states.get(generation_id)
+            if state is not None:
+                state['last_checkpoint'] = time.monotonic()
+
+    def snapshot(self, generation_id: str) -> Optional[Dict[str, Any]]:
+        """Copie de l'état au format attendu par DatabaseManager.save_generation"""
+        with self._lock:
+            state = self._states.get(generation_id)
+            if state is None:
+                return None
+            if len(state['parts']) > 1:
+                state['parts'] = [''.join(state['parts'])]
+            data = {key: value for key, value in state.items() if key not in ('parts', 'last_checkpoint')}
+            data['response'] = state['parts'][0] if state['parts'] else ''
+            return data
+
+    def get_status(self, generation_id: str) -> Optional[Dict[str, Any]]:
+        """Statut d'une génération au même format que DatabaseManager.get_generation_by_id
+
+        Seuls les champs publics sont renvoyés : les clés internes (cache,
+        rattachement à une génération identique) restent hors de l'API.
+        """
+        data = self.snapshot(generation_id)
+        if data is None:
+            return None
+        status = {key: data.get(key) for key in PUBLIC_FIELDS}
+        for key in ('timestamp', 'started_at', 'completed_at'):
+            status[key] = status[key].isoformat() if status[key] else None
+        status['response'] = status['response'].strip()
+        return status
+
+    def discard(self, generation_id: str) -> None:
+        """Retire une génération terminée du suivi en mémoire"""
+        with self._lock:
+            self._states.pop(generation_id, None)
+
+
+class Subscription:
+    """File d'événements d'un lecteur abonné à une génération"""
+
+    def __init__(self, generation_id: str, max_queue_size: int):
+        self.generation_id = generation_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_queue_size)
+
+    def put(self, event: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Lecteur trop lent : il devra se resynchroniser depuis la base
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Attend le prochain événement, None si le délai expire"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reset(self) -> None:
+        """Vide la file après une resynchronisation"""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self.overflowed = False
+
+
+class GenerationEventHub:
+    """Diffusion en mémoire des événements de génération vers les lecteurs SSE
+
+    Les producteurs publient des événements `chunk` et `status` ; chaque
+    lecteur bloque sur sa propre file au lieu d'interroger la base.
+    """
+
+    def __init__(self, max_queue_size: int = 1000):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Subscription]] = {}
+
+    def subscribe(self, generation_id: str) -> Subscription:
+        subscription = Subscription(generation_id, self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(generation_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.generation_id, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.generation_id, None)
+
+    def publish(self, generation_id: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(generation_id, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def publish_chunk(self, generation_id: str, chunk_index: int, content: str) -> None:
+        self.publish(generation_id, {'type': 'chunk', 'chunk_index': chunk_index, 'content': content})
+
+    def publish_status(self, generation_id: str, status: str, progress: float) -> None:
+        self.publish(generation_id, {'type': 'status', 'status': status, 'progress': progress})
+
+
+class SingleFlightGroup:
+    """Regroupe les générations identiques simultanées derrière une génération meneuse
+
+    La première génération d'une clé appelle le provider ; les suivantes
+    s'y rattachent comme suiveuses et reçoivent ses mises à jour.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leaders: Dict[str, str] = {}
+        self._keys: Dict[str, str] = {}
+        self._followers: Dict[str, List[str]] = {}
+
+    def lead_or_follow(self, key: str, generation_id: str) -> Optional[str]:
+        """Enregistre `generation_id` comme meneuse de `key`, ou retourne la meneuse en cours"""
+        with self._lock:
+            leader_id = self._leaders.get(key)
+            if leader_id is not None:
+                return leader_id
+            self._leaders[key] = generation_id
+            self._keys[generation_id] = key
+            self._followers[generation_id] = []
+            return None
+
+    def attach(self, leader_id: str, follower_id: str) -> bool:
+        """Rattache une suiveuse, False si la meneuse est déjà terminée"""
+        with self._lock:
+            if leader_id not in self._followers:
+                return False
+            self._followers[leader_id].append(follower_id)
+            return True
+
+    def followers(self, leader_id: str) -> List[str]:
+        with self._lock:
+            return list(self._followers.get(leader_id, ()))
+
+    def release(self, leader_id: str) -> List[str]:
+        """Retire la meneuse (les requêtes suivantes repartent du provider) et retourne ses suiveuses"""
+        with self._lock:
+            key = self._keys.pop(leader_id, None)
+            if key is not None and self._leaders.get(key) == leader_id:
+                del self._leaders[key]
+            return self._followers.pop(leader_id, [])